@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# GameScene rules for many games at once on NumPy arrays
+
+import sys
+from random import Random
+
+import numpy as np
+
+from spaceinvaders import BLOCKERS_POSITION, ENEMY_DEFAULT_POSITION, \
+    ENEMY_MOVE_DOWN, TICK_TIME, Enemy, HeadlessGame
+
+ROWS = 5
+COLUMNS = 10
+ENEMY_W, ENEMY_H = 40, 35
+BULLET_W, BULLET_H = 5, 15
+SHIP_W, SHIP_H, SHIP_Y = 50, 48, 540
+MYSTERY_W, MYSTERY_H, MYSTERY_Y = 75, 35, 45
+BLOCKER_OFFSETS = (50, 250, 450, 650)
+BLOCKER_SIZE = 10
+MAX_BULLETS = 2
+MAX_ENEMY_BULLETS = 16
+MYSTERY_SCORES = [50, 100, 150, 300]
+NEVER = -10 ** 9
+
+
+def period(millis):
+    # Same rounding as SimClock.set_timer
+    return max(1, int(round(millis / TICK_TIME)))
+
+
+SHOOT_PERIOD = period(700)
+MYSTERY_PERIOD = period(25000)
+
+
+def collide(ax, ay, aw, ah, bx, by, bw, bh):
+    """Rect.colliderect over broadcast arrays"""
+    return (ax < bx + bw) & (bx < ax + aw) & (ay < by + bh) & (by < ay + ah)
+
+
+class BatchGame(object):
+    """N headless games stepped in lockstep.
+
+    Follows HeadlessGame tick for tick: a game started with the same seed
+    and given the same actions ends up in the same state (see crosscheck).
+    Rare per-game events (enemy fire, kills, mystery spawns) are handled
+    in small Python loops so that random draws happen in the same order.
+    """
+
+    def __init__(self, seeds):
+        self.n = len(seeds)
+        self.random = [Random(seed) for seed in seeds]
+        rows, columns = np.mgrid[0:ROWS, 0:COLUMNS]
+        self.enemyRow = rows.ravel()
+        self.enemyColumn = columns.ravel()
+        self.enemyDX = 154 + self.enemyColumn * 50
+        self.enemyDY = self.enemyRow * 45
+        self.enemyScore = np.array([Enemy.row_scores[r]
+                                    for r in self.enemyRow])
+        bunkers, rows, columns = np.mgrid[0:4, 0:4, 0:9]
+        self.blockerRow = rows.ravel()
+        self.blockerX = (np.take(BLOCKER_OFFSETS, bunkers)
+                         + columns * BLOCKER_SIZE).ravel()
+        self.blockerY = BLOCKERS_POSITION + self.blockerRow * BLOCKER_SIZE
+        # Per game, and like GameScene.mysteryVelocity kept across new games
+        self.mysteryVelocity = np.full(self.n, 2)
+
+    def reset(self):
+        n = self.n
+        self.tick = 0
+        self.time = 0
+        self.round = np.ones(n, int)
+        self.over = np.zeros(n, bool)
+        self.score = np.zeros(n, int)
+        self.lives = np.full(n, 3)
+        self.enemyPosition = np.full(n, ENEMY_DEFAULT_POSITION)
+        self.blockers = np.ones((n, len(self.blockerX)), bool)
+        self.nextRound = np.zeros(n, bool)
+        self.nextRoundTimer = np.zeros(n, int)
+
+        self.shipAlive = np.zeros(n, bool)
+        self.shipX = np.zeros(n, int)
+        self.shipTimer = np.zeros(n, int)
+        self.shipExploding = np.zeros(n, bool)
+        self.shipExplosionTimer = np.zeros(n, int)
+        self.explosionEnd = np.full(n, NEVER)
+        self.bulletAlive = np.zeros((n, MAX_BULLETS), bool)
+        self.bulletX = np.zeros((n, MAX_BULLETS), int)
+        self.bulletY = np.zeros((n, MAX_BULLETS), int)
+        self.bulletTimer = np.zeros((n, MAX_BULLETS), int)
+        self.enemyBulletAlive = np.zeros((n, MAX_ENEMY_BULLETS), bool)
+        self.enemyBulletX = np.zeros((n, MAX_ENEMY_BULLETS), int)
+        self.enemyBulletY = np.zeros((n, MAX_ENEMY_BULLETS), int)
+        self.enemyBulletTimer = np.zeros((n, MAX_ENEMY_BULLETS), int)
+        self.mysteryAlive = np.zeros(n, bool)
+        self.mysteryX = np.zeros(n, int)
+        self.mysteryTimer = np.zeros(n, int)
+        self.mysteryScore = np.zeros(n, int)
+
+        self.alive = np.zeros((n, ROWS * COLUMNS), bool)
+        self.columnCount = np.zeros((n, COLUMNS), int)
+        self.offsetX = np.zeros(n, int)
+        self.offsetY = np.zeros(n, int)
+        self.enemyTimer = np.zeros(n, int)
+        self.moveTime = np.zeros(n, int)
+        self.direction = np.zeros(n, int)
+        self.rightMoves = np.zeros(n, int)
+        self.leftMoves = np.zeros(n, int)
+        self.moveNumber = np.zeros(n, int)
+        self.bottom = np.zeros(n, int)
+        self.leftAddMove = np.zeros(n, int)
+        self.rightAddMove = np.zeros(n, int)
+        self.leftAliveColumn = np.zeros(n, int)
+        self.rightAliveColumn = np.zeros(n, int)
+
+        self.shipCreateEvent = np.zeros(n, bool)
+        self.shootEvent = np.zeros(n, bool)
+        self.mysteryEvent = np.zeros(n, bool)
+        self.shootDue = np.zeros(n, int)
+        self.mysteryDue = np.zeros(n, int)
+
+        self._reset_round(np.ones(n, bool))
+        return self.state()
+
+    def _reset_round(self, mask):
+        # GameScene.reset
+        t = self.time
+        self.shipAlive[mask] = True
+        self.shipX[mask] = 375
+        self.shipTimer[mask] = t
+        self.shipExploding[mask] = False
+        self.explosionEnd[mask] = NEVER
+        self.bulletAlive[mask] = False
+        self.enemyBulletAlive[mask] = False
+        self.mysteryAlive[mask] = False
+
+        self.alive[mask] = True
+        self.columnCount[mask] = ROWS
+        self.offsetX[mask] = 0
+        self.offsetY[mask] = 0
+        self.enemyTimer[mask] = t
+        self.moveTime[mask] = 600
+        self.direction[mask] = 1
+        self.rightMoves[mask] = 30
+        self.leftMoves[mask] = 30
+        self.moveNumber[mask] = 15
+        self.bottom[mask] = self.enemyPosition[mask] + (ROWS - 1) * 45 + 35
+        self.leftAddMove[mask] = 0
+        self.rightAddMove[mask] = 0
+        self.leftAliveColumn[mask] = 0
+        self.rightAliveColumn[mask] = COLUMNS - 1
+
+        self.shipCreateEvent[mask] = False
+        self.shootEvent[mask] = False
+        self.mysteryEvent[mask] = False
+        self.shootDue[mask] = self.tick + SHOOT_PERIOD
+        self.mysteryDue[mask] = self.tick + MYSTERY_PERIOD
+
+    def step(self, actions):
+        """actions: [n, 3] booleans (left, right, fire) for this tick"""
+        actions = np.asarray(actions, bool)
+        left, right, fire = actions[:, 0], actions[:, 1], actions[:, 2]
+        t = self.time
+        live = ~self.over
+        play = live & ~self.nextRound
+        waiting = live & self.nextRound
+
+        self._process_events(play, fire, t)
+        self._update(play, left, right, t)
+
+        # NextRoundScene.update
+        finish = waiting & (t - self.nextRoundTimer > 3000)
+        if finish.any():
+            self.nextRound[finish] = False
+            self.enemyPosition[finish] += ENEMY_MOVE_DOWN
+            self.round[finish] += 1
+            self._reset_round(finish)
+
+        # SimClock.step
+        self.tick += 1
+        self.time = int(self.tick * TICK_TIME)
+        due = live & (self.shootDue <= self.tick)
+        self.shootEvent |= due
+        self.shootDue[due] += SHOOT_PERIOD
+        due = live & (self.mysteryDue <= self.tick)
+        self.mysteryEvent |= due
+        self.mysteryDue[due] += MYSTERY_PERIOD
+        return self.state()
+
+    def _process_events(self, play, fire, t):
+        # Queue order: ship create, enemy shoot, mystery, then the key press
+        create = play & self.shipCreateEvent
+        self.shipAlive[create] = True
+        self.shipX[create] = 375
+        self.shipTimer[create] = t
+
+        for g in np.flatnonzero(play & self.shootEvent
+                                & self.alive.any(axis=1)):
+            self._enemy_shoot(g, t)
+
+        for g in np.flatnonzero(play & self.mysteryEvent):
+            self.mysteryAlive[g] = True
+            self.mysteryX[g] = -80 if self.mysteryVelocity[g] > 0 else 800
+            self.mysteryScore[g] = self.random[g].choice(MYSTERY_SCORES)
+            self.mysteryTimer[g] = t
+
+        # Events reaching a NextRoundScene are dropped as well
+        live = ~self.over
+        self.shipCreateEvent[live] = False
+        self.shootEvent[live] = False
+        self.mysteryEvent[live] = False
+
+        shoot = play & fire & self.shipAlive & ~self.bulletAlive.any(axis=1)
+        y = SHIP_Y + 5
+        single = shoot & (self.score < 1000)
+        double = shoot & ~single
+        self.bulletX[single, 0] = self.shipX[single] + 23
+        self.bulletX[double, 0] = self.shipX[double] + 8
+        self.bulletX[double, 1] = self.shipX[double] + 38
+        self.bulletAlive[single, 0] = True
+        self.bulletAlive[double] = True
+        self.bulletY[shoot] = y
+        self.bulletTimer[shoot] = t
+
+    def _enemy_shoot(self, g, t):
+        columns = np.flatnonzero(self.columnCount[g]).tolist()
+        column = self.random[g].choice(columns)
+        rows = np.flatnonzero(self.alive[g, column::COLUMNS])
+        index = rows[-1] * COLUMNS + column
+        free = np.flatnonzero(~self.enemyBulletAlive[g])
+        if not len(free):
+            raise RuntimeError('More than %d enemy bullets'
+                               % MAX_ENEMY_BULLETS)
+        slot = free[0]
+        self.enemyBulletAlive[g, slot] = True
+        self.enemyBulletX[g, slot] = (self.enemyDX[index]
+                                      + self.offsetX[g] + 14)
+        self.enemyBulletY[g, slot] = (self.enemyPosition[g]
+                                      + self.enemyDY[index]
+                                      + self.offsetY[g] + 20)
+        self.enemyBulletTimer[g, slot] = t
+
+    def _update(self, play, left, right, t):
+        # Ship.update
+        move = play & self.shipAlive & (t - self.shipTimer > 20)
+        self.shipTimer[move] = t
+        self.shipX[move & left & (self.shipX > 10)] -= 5
+        self.shipX[move & right & (self.shipX < 740)] += 5
+
+        # Bullet.update
+        for alive, y, timer, velocity in (
+                (self.bulletAlive, self.bulletY, self.bulletTimer, -15),
+                (self.enemyBulletAlive, self.enemyBulletY,
+                 self.enemyBulletTimer, 5)):
+            active = play[:, None] & alive
+            move = active & (t - timer > 20)
+            timer[move] = t
+            y[move] += velocity
+            alive &= ~(active & ((y < 15) | (y > 600)))
+
+        # Mystery.update
+        move = play & self.mysteryAlive & (t - self.mysteryTimer > 20)
+        self.mysteryTimer[move] = t
+        self.mysteryX[move] += self.mysteryVelocity[move]
+        gone = move & ((self.mysteryX < -80) | (self.mysteryX > 800))
+        self.mysteryVelocity[gone] *= -1
+        self._kill_mystery(gone)
+
+        # ShipExplosion.update
+        done = play & self.shipExploding & (t - self.shipExplosionTimer > 900)
+        self.shipExploding[done] = False
+        self.shipCreateEvent |= done
+
+        # GameScene.update
+        busy = (self.alive.any(axis=1) | (t <= self.explosionEnd)
+                | self.shipExploding | self.mysteryAlive
+                | self.enemyBulletAlive.any(axis=1))
+        finished = play & ~busy
+        self.nextRound[finished] = True
+        self.nextRoundTimer[finished] = t
+        active = play & busy
+        self._move_enemies(active, t)
+        self._check_collisions(active, t)
+
+    def _kill_mystery(self, mask):
+        self.mysteryAlive[mask] = False
+        self.mysteryDue[mask] = self.tick + MYSTERY_PERIOD
+
+    def _move_enemies(self, active, t):
+        due = active & (t - self.enemyTimer > self.moveTime)
+        max_move = np.where(self.direction == 1,
+                            self.rightMoves + self.rightAddMove,
+                            self.leftMoves + self.leftAddMove)
+        turn = due & (self.moveNumber >= max_move)
+        shift = due & ~turn
+
+        self.leftMoves[turn] = 30 + self.rightAddMove[turn]
+        self.rightMoves[turn] = 30 + self.leftAddMove[turn]
+        self.direction[turn] *= -1
+        self.moveNumber[turn] = 0
+        self.offsetY[turn] += ENEMY_MOVE_DOWN
+        rows = self.alive.reshape(-1, ROWS, COLUMNS).any(axis=2)
+        lowest = ROWS - 1 - np.argmax(rows[:, ::-1], axis=1)
+        bottom = self.enemyPosition + lowest * 45 + self.offsetY + ENEMY_H
+        self.bottom[turn] = np.where(rows.any(axis=1), bottom, 0)[turn]
+
+        self.offsetX[shift] += 10 * self.direction[shift]
+        self.moveNumber[shift] += 1
+        self.enemyTimer[due] += self.moveTime[due]
+
+    def _kill_enemy(self, g, index):
+        # EnemiesGroup._kill and _update_speed
+        column = index % COLUMNS
+        self.alive[g, index] = False
+        self.columnCount[g, column] -= 1
+        counts = self.columnCount[g]
+        is_column_dead = counts[column] == 0
+        if column == self.rightAliveColumn[g]:
+            while self.rightAliveColumn[g] > 0 and is_column_dead:
+                self.rightAliveColumn[g] -= 1
+                self.rightAddMove[g] += 5
+                is_column_dead = counts[self.rightAliveColumn[g]] == 0
+        elif column == self.leftAliveColumn[g]:
+            while self.leftAliveColumn[g] < COLUMNS and is_column_dead:
+                self.leftAliveColumn[g] += 1
+                self.leftAddMove[g] += 5
+                is_column_dead = counts[self.leftAliveColumn[g]] == 0
+
+        remaining = counts.sum()
+        if remaining == 1:
+            self.moveTime[g] = 200
+        elif remaining <= 10:
+            self.moveTime[g] = 400
+
+    def _check_collisions(self, active, t):
+        ex = (self.enemyDX[None, :] + self.offsetX[:, None])
+        ey = (self.enemyPosition[:, None] + self.enemyDY[None, :]
+              + self.offsetY[:, None])
+        bx, by = self.bulletX, self.bulletY
+        ebx, eby = self.enemyBulletX, self.enemyBulletY
+
+        # Bullets against enemy bullets, one player bullet at a time
+        for slot in range(MAX_BULLETS):
+            hit = (active[:, None] & self.bulletAlive[:, slot, None]
+                   & self.enemyBulletAlive
+                   & collide(bx[:, slot, None], by[:, slot, None],
+                             BULLET_W, BULLET_H,
+                             ebx, eby, BULLET_W, BULLET_H))
+            self.enemyBulletAlive &= ~hit
+            self.bulletAlive[:, slot] &= ~hit.any(axis=1)
+
+        # Enemies against bullets: each bullet kills the first enemy it hits
+        hit = (active[:, None, None] & self.alive[:, :, None]
+               & self.bulletAlive[:, None, :]
+               & collide(ex[:, :, None], ey[:, :, None], ENEMY_W, ENEMY_H,
+                         bx[:, None, :], by[:, None, :], BULLET_W, BULLET_H))
+        struck = hit.any(axis=1)
+        if struck.any():
+            killed = np.zeros_like(self.alive)
+            games, slots = np.nonzero(struck)
+            killed[games, np.argmax(hit, axis=1)[games, slots]] = True
+            self.bulletAlive &= ~struck
+            self.score += (killed * self.enemyScore).sum(axis=1)
+            exploded = killed.any(axis=1)
+            self.explosionEnd[exploded] = np.maximum(
+                self.explosionEnd[exploded], t + 200)
+            for g, index in zip(*np.nonzero(killed)):
+                self._kill_enemy(g, index)
+
+        # Mystery against bullets
+        hit = (active[:, None] & self.mysteryAlive[:, None] & self.bulletAlive
+               & collide(self.mysteryX[:, None], MYSTERY_Y,
+                         MYSTERY_W, MYSTERY_H, bx, by, BULLET_W, BULLET_H))
+        struck = hit.any(axis=1)
+        if struck.any():
+            self.bulletAlive &= ~hit
+            self._kill_mystery(struck)
+            self.score[struck] += self.mysteryScore[struck]
+            self.explosionEnd[struck] = np.maximum(
+                self.explosionEnd[struck], t + 600)
+            self.mysteryVelocity[struck] = 2
+
+        # Ship against enemy bullets
+        hit = (active[:, None] & self.shipAlive[:, None]
+               & self.enemyBulletAlive
+               & collide(self.shipX[:, None], SHIP_Y, SHIP_W, SHIP_H,
+                         ebx, eby, BULLET_W, BULLET_H))
+        struck = hit.any(axis=1)
+        if struck.any():
+            self.enemyBulletAlive &= ~hit
+            self.shipAlive[struck] = False
+            self.over |= struck & (self.lives == 0)
+            self.lives[struck & (self.lives > 0)] -= 1
+            self.shipExploding[struck] = True
+            self.shipExplosionTimer[struck] = t
+
+        # Enemies reaching the ship
+        low = active & (self.bottom >= 540)
+        if low.any():
+            hit = (low[:, None] & self.shipAlive[:, None] & self.alive
+                   & collide(ex, ey, ENEMY_W, ENEMY_H,
+                             self.shipX[:, None], SHIP_Y, SHIP_W, SHIP_H))
+            struck = hit.any(axis=1)
+            first = np.argmax(hit, axis=1)
+            for g in np.flatnonzero(struck):
+                self._kill_enemy(g, first[g])
+            self.shipAlive[struck] = False
+            self.over |= low & (~self.shipAlive | (self.bottom >= 600))
+
+        # Bullets against blockers: the lowest cell goes for player bullets,
+        # the highest one for enemy bullets, leftmost on ties
+        index = np.arange(len(self.blockerX))
+        for alive, x, y, rank in (
+                (self.bulletAlive, bx, by,
+                 self.blockerRow * len(index) - index),
+                (self.enemyBulletAlive, ebx, eby,
+                 -self.blockerRow * len(index) - index)):
+            hit = (active[:, None, None] & alive[:, :, None]
+                   & self.blockers[:, None, :]
+                   & collide(x[:, :, None], y[:, :, None], BULLET_W, BULLET_H,
+                             self.blockerX, self.blockerY,
+                             BLOCKER_SIZE, BLOCKER_SIZE))
+            struck = hit.any(axis=2)
+            if struck.any():
+                best = np.argmax(np.where(hit, rank, NEVER), axis=2)
+                games, slots = np.nonzero(struck)
+                self.blockers[games, best[games, slots]] = False
+                alive &= ~struck
+
+        # Enemies crushing blockers
+        low = active & (self.bottom >= BLOCKERS_POSITION)
+        if low.any():
+            hit = (low[:, None, None] & self.alive[:, :, None]
+                   & self.blockers[:, None, :]
+                   & collide(ex[:, :, None], ey[:, :, None], ENEMY_W, ENEMY_H,
+                             self.blockerX, self.blockerY,
+                             BLOCKER_SIZE, BLOCKER_SIZE))
+            self.blockers &= ~hit.any(axis=1)
+
+    def state(self):
+        return {
+            'time': self.time,
+            'round': self.round.copy(),
+            'over': self.over.copy(),
+            'score': self.score.copy(),
+            'lives': self.lives.copy(),
+            'ship': np.where(self.shipAlive, self.shipX, -1),
+            'enemies': self.alive.sum(axis=1),
+            'mystery': np.where(self.mysteryAlive, self.mysteryX, -1),
+        }
+
+
+def summary(game):
+    """Comparable per-tick state of one HeadlessGame"""
+    scene = game.gameScene
+    state = game.state()
+    return (state['round'], state['over'], state['score'], state['lives'],
+            state['ship'], state['mystery'],
+            isinstance(game.scene, type(scene)),
+            sorted(state['bullets']), sorted(state['enemyBullets']),
+            sorted(e.rect.topleft for e in scene.enemies),
+            sorted(cell for bunker in scene.blockers
+                   for cell in bunker.intact()))
+
+
+def batch_summary(batch, g):
+    """Same as summary() for game g of a BatchGame"""
+    def sprites(alive, x, y):
+        return sorted((int(a), int(b)) for a, b in zip(x[alive], y[alive]))
+
+    ex = batch.enemyDX + batch.offsetX[g]
+    ey = batch.enemyPosition[g] + batch.enemyDY + batch.offsetY[g]
+    return (int(batch.round[g]), bool(batch.over[g]), int(batch.score[g]),
+            int(batch.lives[g]),
+            int(batch.shipX[g]) if batch.shipAlive[g] else None,
+            int(batch.mysteryX[g]) if batch.mysteryAlive[g] else None,
+            not batch.nextRound[g],
+            sprites(batch.bulletAlive[g], batch.bulletX[g], batch.bulletY[g]),
+            sprites(batch.enemyBulletAlive[g], batch.enemyBulletX[g],
+                    batch.enemyBulletY[g]),
+            sprites(batch.alive[g], ex, ey),
+            sprites(batch.blockers[g], batch.blockerX, batch.blockerY))
+
+
+def dodge(batch, random_state):
+    """Random actions that keep firing and step away from enemy bullets,
+    so that checked games last several rounds"""
+    actions = random_state.random_sample((batch.n, 3)) < (0.2, 0.2, 0.9)
+    center = batch.shipX[:, None] + SHIP_W // 2
+    near = (batch.enemyBulletAlive & (batch.enemyBulletY > 400)
+            & (abs(batch.enemyBulletX - center) < 40))
+    threat = near.any(axis=1)
+    from_right = (np.where(near, batch.enemyBulletX, 0).max(axis=1)
+                  >= center[:, 0])
+    actions[threat, 0] = from_right[threat]
+    actions[threat, 1] = ~from_right[threat]
+    return actions
+
+
+def crosscheck(seeds, ticks, action_seed=0):
+    """Step BatchGame and one HeadlessGame per seed with the same actions,
+    returning the first (tick, game) whose states differ."""
+    random_state = np.random.RandomState(action_seed)
+    batch = BatchGame(seeds)
+    batch.reset()
+    games = []
+    for seed in seeds:
+        games.append(HeadlessGame(seed))
+        games[-1].reset()
+    for tick in range(ticks):
+        actions = dodge(batch, random_state)
+        batch.step(actions)
+        for g, game in enumerate(games):
+            game.step(actions[g])
+            if summary(game) != batch_summary(batch, g):
+                return tick, g
+    return None
+
+
+if __name__ == '__main__':
+    mismatch = crosscheck(list(range(8)), 30000)
+    if mismatch:
+        sys.exit('BatchGame differs from HeadlessGame at tick %d, game %d'
+                 % mismatch)
+    print('BatchGame matches HeadlessGame')
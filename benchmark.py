@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# Performance benchmarks, run headless:
+#   python benchmark.py          compare against benchmark_baseline.json
+#   python benchmark.py --save   store the current results as the baseline
+#   python benchmark.py --scale  also play 10x and 100x the default game
+
+import gc
+import json
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from os import environ
+from os.path import abspath, dirname, join
+from statistics import median
+from timeit import default_timer, repeat
+
+# Off screen and silent, so results do not depend on the display
+environ['SDL_VIDEODRIVER'] = 'dummy'
+environ['SDL_AUDIODRIVER'] = 'dummy'
+
+from pygame import Rect, Surface
+from pygame.sprite import groupcollide, DirtySprite, Group, LayeredDirty
+from spaceinvaders import ENEMY_DEFAULT_POSITION, ENEMY_MOVE_DOWN, \
+    POOLED, Bullet, GameConfig, HeadlessGame, Img, Mystery, Txt
+
+BASELINE_PATH = join(abspath(dirname(__file__)), 'benchmark_baseline.json')
+ROUNDS = 5  # Timings of a scenario, of which the median counts
+# Allowed change before a result counts as a regression. Timings are noisy
+# and machine dependent, so only ratios of timings taken in the same run are
+# judged: a scenario's speed relative to the reference, a stock pygame
+# tick, collisions relative to groupcollide, and a snapshot or restore in
+# steps of the game. Dirty and blitted areas are deterministic. Absolute
+# timings are reported but never judged.
+THRESHOLDS = {'speed': 0.25, 'alloc': 0.5, 'area': 0.01, 'blitted': 0.01,
+              'ratio': 0.5, 'snapshotSteps': 0.5, 'restoreSteps': 0.5}
+
+
+def swarm_at_blockers():
+    """A game with the swarm reaching the blockers and bullets in flight"""
+    game = HeadlessGame(seed=0)
+    game.reset()
+    scene = game.gameScene
+    scene.enemyPosition = 250
+    scene.reset()
+    for x in (60, 105, 265, 330, 470, 515, 660, 720):
+        Bullet.spawn(scene, x, 470, 5, 'enemylaser', scene.enemyBullets)
+    for x in (80, 110):
+        Bullet.spawn(scene, x, 480, -15, 'laser', scene.bullets)
+    return scene
+
+
+def sprite_blockers(scene):
+    """The intact blocker cells as one sprite each, as they used to be"""
+    blockers = Group()
+    for bunker in scene.blockers:
+        for x, y in bunker.intact():
+            cell = DirtySprite(blockers)
+            cell.rect = Rect(x, y, bunker.cell, bunker.cell)
+    return blockers
+
+
+def bench_collisions(number=2000):
+    """check_collisions' enemy and blocker tests: groupcollide all-pairs
+    on sprites against formation cells and bunker bitmaps, without
+    destroying anything"""
+    scene = swarm_at_blockers()
+    blockers = sprite_blockers(scene)
+
+    def pairs():
+        return (groupcollide(scene.enemies, scene.bullets, False, False),
+                groupcollide(scene.bullets, blockers, False, False),
+                groupcollide(scene.enemyBullets, blockers, False, False),
+                groupcollide(scene.enemies, blockers, False, False))
+
+    def cells():
+        return ([next(scene.enemies.collide(b.rect), None)
+                 for b in scene.bullets],
+                [bunker.lowest(b.rect) for b in scene.bullets
+                 for bunker in scene.blockers
+                 if bunker.rect.colliderect(b.rect)],
+                [bunker.highest(b.rect) for b in scene.enemyBullets
+                 for bunker in scene.blockers
+                 if bunker.rect.colliderect(b.rect)],
+                [bunker._span(e.rect) for bunker in scene.blockers
+                 for e in scene.enemies.collide(bunker.rect)])
+
+    results = {}
+    for name, check in (('groupcollide', pairs), ('cells', cells)):
+        best = min(repeat(check, number=number, repeat=3))
+        results[name] = best / number * 1e6
+    results['ratio'] = results['cells'] / results['groupcollide']
+    return results
+
+
+def bench_clone(number=200, ticks=600, steps=50):
+    """HeadlessGame.snapshot() and restore() in the middle of erosion, in
+    microseconds and in steps, relative to a step() from there timed in the
+    same round, and how many clones, a snapshot restored into another game,
+    fit in a second"""
+    game, policy = erosion()
+    for tick in range(ticks):
+        game.step(policy(tick))
+    clone = HeadlessGame(seed=0)
+    clone.reset()
+    state = game.snapshot()
+
+    def play():
+        for tick in range(ticks, ticks + steps):
+            clone.step(policy(tick))
+
+    timings = {'step': [], 'snapshot': [], 'restore': []}
+    for _ in range(ROUNDS):
+        best = min(repeat(play, lambda: clone.restore(state), number=1,
+                          repeat=3))
+        timings['step'].append(best / steps)
+        for name, func in (('snapshot', game.snapshot),
+                           ('restore', lambda: clone.restore(state))):
+            best = min(repeat(func, number=number, repeat=3))
+            timings[name].append(best / number)
+    results = {name: median(values) * 1e6
+               for name, values in timings.items()}
+    for name in ('snapshot', 'restore'):
+        results[name + 'Steps'] = median(
+            value / step for value, step in zip(timings[name],
+                                                timings['step']))
+    results['clones'] = 1e6 / (results['snapshot'] + results['restore'])
+    return results
+
+
+def sweep(tick, fire=True):
+    """Walk the ship across the screen and back, firing"""
+    right = tick // 120 % 2 == 0
+    return not right, right, fire
+
+
+def swarm():
+    """Full 50-enemy swarm marching, the ship idle"""
+    game = HeadlessGame(seed=1)
+    game.reset()
+    return game, lambda tick: (False, False, False)
+
+
+def erosion():
+    """Constant fire into the blockers from below and above"""
+    game = HeadlessGame(seed=2)
+    game.reset()
+    return game, sweep
+
+
+def mystery():
+    """The mystery ship crossing the whole screen"""
+    game = HeadlessGame(seed=3)
+    game.reset()
+    scene = game.gameScene
+    Mystery(scene, scene.mysteries)
+    return game, lambda tick: (False, False, False)
+
+
+def two_bullets():
+    """Above 1000 points, every shot is two bullets"""
+    game = HeadlessGame(seed=4)
+    game.reset()
+    game.gameScene.scoreTxt.msg = 1000
+    return game, sweep
+
+
+def late_round():
+    """Fifth round: the swarm starts low and soon eats the blockers"""
+    game = HeadlessGame(seed=0)
+    game.reset()
+    scene = game.gameScene
+    scene.enemyPosition = ENEMY_DEFAULT_POSITION + 4 * ENEMY_MOVE_DOWN
+    scene.reset()
+    return game, sweep
+
+
+SCENARIOS = (swarm, erosion, mystery, two_bullets, late_round)
+
+
+def scaled(factor):
+    """erosion with GameConfig.scaled(factor)"""
+    def scenario():
+        game = HeadlessGame(seed=2, config=GameConfig.scaled(factor))
+        game.reset()
+        return game, sweep
+    scenario.__name__ = 'scale%d' % factor
+    scenario.factor = factor
+    return scenario
+
+
+SCALES = tuple(scaled(factor) for factor in (1, 10, 100))
+
+
+def reference(ticks):
+    """Seconds stock pygame takes for ticks of the kind of work a game tick
+    does, moving a few dozen DirtySprites, colliding them with a few more
+    and drawing them through LayeredDirty, to measure the machine by"""
+    screen = Surface((800, 600))
+    group, bullets = LayeredDirty(), Group()
+    for i in range(60):
+        sprite = DirtySprite(group)
+        sprite.image = Surface((40, 30))
+        sprite.rect = Rect(100 + i % 10 * 50, 65 + i // 10 * 45, 40, 30)
+    for i in range(10):
+        sprite = DirtySprite(bullets)
+        sprite.rect = Rect(50 + i * 70, 0, 5, 10)
+    group.clear(screen, Surface((800, 600)))
+    gc.disable()  # As timeit does
+    start = default_timer()
+    for tick in range(ticks):
+        step = 10 if tick // 30 % 2 else -10
+        for i, sprite in enumerate(group):
+            if i % 6 == tick % 6:
+                sprite.rect.x += step
+                sprite.dirty = 1
+        for bullet in bullets:
+            bullet.rect.y = tick * 5 % 600
+        groupcollide(group, bullets, False, False)
+        group.draw(screen)
+    elapsed = default_timer() - start
+    gc.enable()
+    return elapsed
+
+
+def run_scenario(scenario, ticks):
+    """Step and render a scenario, returning ticks per second, the speed
+    relative to the reference, peak bytes allocated within a tick, and dirty
+    and blitted pixels per tick"""
+    times, speeds = [], []
+    for _ in range(ROUNDS):
+        # The reference timed right before, so that both see the machine
+        # equally busy
+        machine = reference(ticks)
+        game, policy = scenario()
+        screen = Surface(game.config.size)
+        game.render(screen)
+        area = blitted = 0
+        gc.disable()
+        start = default_timer()
+        for tick in range(ticks):
+            game.step(policy(tick))
+            area += sum(rect.w * rect.h for rect in game.render(screen))
+            blitted += game.scene.blitted
+        elapsed = default_timer() - start
+        gc.enable()
+        times.append(elapsed)
+        speeds.append(machine / elapsed)
+
+    # Same run again, under tracemalloc, which is too slow to time
+    game, policy = scenario()
+    game.render(screen)
+    tracemalloc.start()
+    peak = 0
+    for tick in range(ticks):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        game.step(policy(tick))
+        game.render(screen)
+        peak += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return {'fps': ticks / median(times), 'speed': median(speeds),
+            'alloc': peak / ticks, 'area': area / ticks,
+            'blitted': blitted / ticks}
+
+
+def scaling(results):
+    """Cost of a tick per enemy at every scale, relative to 1x; above 1
+    means a subsystem grows faster than the game"""
+    base = results['scale1']['fps']
+    return {scenario.__name__: base / results[scenario.__name__]['fps']
+            / scenario.factor for scenario in SCALES[1:]}
+
+
+def run(ticks=1200, scale=False):
+    results = {}
+    for scenario in SCENARIOS + (SCALES if scale else ()):
+        results[scenario.__name__] = run_scenario(scenario, ticks)
+    results['collisions'] = bench_collisions()
+    results['clone'] = bench_clone()
+    results['caches'] = {'txt': Txt.cache.stats()['hitRate'],
+                         'img': Img.cache.stats()['hitRate']}
+    results['pools'] = {cls.__name__: cls.pool.stats()['reuseRate']
+                        for cls in POOLED}
+    return results
+
+
+def regressions(results, baseline):
+    """(name, metric, baseline, result) of every result beyond its
+    threshold; speed should not drop, the others should not grow"""
+    found = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if old is None:
+                continue
+            limit = THRESHOLDS.get(metric)
+            if limit is None:
+                continue
+            if metric == 'speed':
+                worse = value < old * (1 - limit)
+            else:
+                worse = value > old * (1 + limit) + 1e-9
+            if worse:
+                found.append((name, metric, old, value))
+    return found
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Space Invaders benchmarks')
+    parser.add_argument('--ticks', type=int, default=1200)
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--scale', action='store_true',
+                        help='also run the game at 10x and 100x scale')
+    args = parser.parse_args()
+
+    results = run(args.ticks, args.scale)
+    print('%-12s %10s %6s %12s %12s %12s'
+          % ('scenario', 'ticks/s', 'speed', 'alloc B/tick', 'dirty px/tick',
+             'blit px/tick'))
+    for scenario in SCENARIOS + (SCALES if args.scale else ()):
+        r = results[scenario.__name__]
+        print('%-12s %10.0f %6.2f %12.0f %12.0f %12.0f'
+              % (scenario.__name__, r['fps'], r['speed'], r['alloc'],
+                 r['area'], r['blitted']))
+    collisions = results['collisions']
+    print('collisions: cells %.1f us, groupcollide %.1f us (%.2fx)'
+          % (collisions['cells'], collisions['groupcollide'],
+             collisions['ratio']))
+    clone = results['clone']
+    print('clone: snapshot %.1f us (%.2f steps), restore %.1f us (%.2f '
+          'steps), step %.1f us (%.0f clones/s)'
+          % (clone['snapshot'], clone['snapshotSteps'], clone['restore'],
+             clone['restoreSteps'], clone['step'], clone['clones']))
+    print('render cache hit rates: Txt %.1f%%, Img %.1f%%'
+          % (results['caches']['txt'] * 100, results['caches']['img'] * 100))
+    print('pool reuse rates: ' + ', '.join(
+        '%s %.1f%%' % (name, rate * 100)
+        for name, rate in sorted(results['pools'].items())))
+    growth = scaling(results) if args.scale else {}
+    if growth:
+        print('tick cost per enemy vs scale1: ' + ', '.join(
+            '%s %.2f' % (name, growth[name]) for name in sorted(growth)))
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        sys.exit()
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except IOError:
+        sys.exit('No baseline yet, run with --save')
+    found = regressions(results, baseline)
+    found.extend((name, 'scaling', 1.0, value)
+                 for name, value in growth.items() if value > 1.0)
+    for name, metric, old, new in found:
+        print('REGRESSION %s %s: %.2f -> %.2f' % (name, metric, old, new))
+    sys.exit(1 if found else 0)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# Gameplay capture from the dirty rects of each frame, written off the game
+# loop:
+#   python spaceinvaders.py --capture frames/%06d.png    PNG sequence
+#   python spaceinvaders.py --capture game.rgb           raw RGB frames
+#   python spaceinvaders.py --capture '|ffmpeg -f rawvideo -pix_fmt rgb24
+#       -s 800x600 -r 60 -i - game.mp4'                  piped to an encoder
+
+import shlex
+import subprocess
+from queue import Full, Queue
+from threading import Thread
+
+from pygame import Rect, Surface, image
+
+RING_SIZE = 120  # Frames the writer may fall behind before some are dropped
+MAX_PATCHES = 64  # Beyond this many rects a frame is copied whole
+
+
+class FrameCapture(Thread):
+    """Copies the rects each draw changed into a ring of patches, which a
+    writer thread pastes onto its own canvas to rebuild and write every
+    frame. When the ring is full a frame is dropped: its rects are copied
+    with the next frame's, and raw output repeats the frame before."""
+
+    def __init__(self, target, size, every=1, ring=RING_SIZE):
+        super(FrameCapture, self).__init__(name='capture', daemon=True)
+        self.target = target
+        self.size = size
+        self.every = every  # Capture one frame in every
+        self.ring = Queue(maxsize=ring)
+        self.frames = self.captured = self.dropped = self.written = 0
+        self.error = None
+        self._bounds = Rect((0, 0), size)
+        self._damage = [self._bounds]  # Changed since the last capture
+        self.start()
+
+    def frame(self, surface, dirty):
+        """Take a frame drawn on surface, dirty being the rects draw()
+        returned"""
+        self.frames += 1
+        self._damage.extend(dirty)
+        if self.frames % self.every:
+            return
+        if self.ring.full():
+            self.dropped += 1
+            return
+        damage = self._damage
+        if len(damage) > MAX_PATCHES:
+            damage = [self._bounds]
+        patches = []
+        for rect in damage:
+            rect = rect.clip(self._bounds)
+            if rect.w and rect.h:
+                patches.append((rect, surface.subsurface(rect).copy()))
+        try:
+            self.ring.put_nowait((self.frames, patches))
+        except Full:
+            self.dropped += 1
+            return
+        self._damage = []
+        self.captured += 1
+
+    def _open(self):
+        if self.target.startswith('|'):
+            process = subprocess.Popen(shlex.split(self.target[1:]),
+                                       stdin=subprocess.PIPE)
+            return process.stdin, process
+        if '%' in self.target:
+            return None, None
+        return open(self.target, 'wb'), None
+
+    def run(self):
+        canvas = Surface(self.size)
+        sink, process = self._open()
+        previous = 0
+        try:
+            while True:
+                item = self.ring.get()
+                if item is None:
+                    break
+                number, patches = item
+                for rect, patch in patches:
+                    canvas.blit(patch, rect)
+                if sink is None:
+                    image.save(canvas, self.target % number)
+                    self.written += 1
+                    continue
+                if self.error:
+                    continue  # Drain the ring, the sink is gone
+                # The frames dropped since the previous one repeat it
+                repeat = max(1, (number - previous) // self.every)
+                try:
+                    if previous and repeat > 1:
+                        sink.write(last * (repeat - 1))
+                    last = image.tobytes(canvas, 'RGB')
+                    sink.write(last)
+                    self.written += repeat
+                except OSError as e:
+                    self.error = e
+                previous = number
+        finally:
+            if sink is not None:
+                try:
+                    sink.close()
+                except OSError:
+                    pass
+            if process is not None:
+                process.wait()
+
+    def close(self, surface=None):
+        """Write the frames still in the ring, and the last frame drawn on
+        surface if it was dropped, and wait for them"""
+        if surface is not None and self._damage:
+            self.ring.put((self.frames, [(self._bounds, surface.copy())]))
+            self.captured += 1
+        self.ring.put(None)
+        self.join()
+
+    def stats(self):
+        return {'captured': self.captured, 'dropped': self.dropped,
+                'written': self.written, 'pending': self.ring.qsize()}
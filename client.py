@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# Plays or watches a session of server.py, drawn with the game's sprites:
+#   python client.py [SESSION] [--spectate]
+
+import asyncio
+import json
+import sys
+from argparse import ArgumentParser
+
+from pygame import display, event, init, key, mixer
+from pygame.constants import QUIT, KEYDOWN, K_ESCAPE, K_LEFT, K_RIGHT, \
+    K_SPACE
+
+from server import HOST, PORT, dumps
+from spaceinvaders import AUDIO_BUFFER, AUDIO_FORMAT, DEFAULT_CONFIG, FONT, \
+    HEADLESS, RESTORABLE, WHITE, AudioThread, GameScene, Mystery, \
+    NullAudio, Ship, SimClock, Txt, ASSETS
+
+
+class RemoteGame(object):
+    """A GameScene that follows the keyframes and deltas of a server
+    Session instead of playing by its own rules. Only bullets and
+    explosions are updated here, the same way the server does."""
+
+    def __init__(self, config=DEFAULT_CONFIG, audio=None):
+        self.config = config
+        self.clock = SimClock()
+        self.scene = GameScene(on_round=None, on_over=None, clock=self.clock,
+                               events=self.clock, config=config, audio=audio)
+        self.scene.new_game()
+        self.sprites = {}  # serial: pooled sprite
+        self.banners = {
+            'nextRound': Txt(FONT, 50, 'Next Round', WHITE,
+                             *config.center(240, 270)),
+            'over': Txt(FONT, 50, 'Game Over', WHITE,
+                        *config.center(250, 270))}
+        self.repaint = True
+
+    def apply(self, message):
+        if 'view' in message:
+            self.keyframe(message['view'])
+            return
+        scene = self.scene
+        enemies = scene.enemies
+        if 'tick' in message:
+            self.clock.tick = message['tick']
+            now = self.clock.get_ticks()
+            for group in (scene.bullets, scene.enemyBullets,
+                          scene.explosions):
+                group.update(now)
+        if 'swarm' in message:
+            x, y, frame = message['swarm']
+            old = enemies.swarm.rect
+            enemies.x, enemies.y = x, y
+            enemies.swarm.place(x, y, frame)
+            enemies._repaint_rows(enemies.swarm.rect.x - old.x,
+                                  enemies.swarm.rect.y - old.y)
+        for row, column in message.get('kills', ()):
+            enemies.enemies[row][column].kill()
+        bunkers = scene.blockers.sprites()
+        for bunker, column, row in message.get('cells', ()):
+            bunkers[bunker].destroy(column, row)
+        for serial in message.get('gone', ()):
+            sprite = self.sprites.pop(serial, None)
+            if sprite is not None:
+                sprite.kill()
+        for state in message.get('spawn', ()):
+            self.spawn(state)
+        self.fields(message)
+        self.clock.clear()  # Nothing here handles the scene's events
+
+    def spawn(self, state):
+        sprite = RESTORABLE[state[1]].restore(self.scene, state[1:])
+        self.sprites[state[0]] = sprite
+
+    def fields(self, fields):
+        scene = self.scene
+        if 'ship' in fields:
+            x = fields['ship']
+            if x is None:
+                scene.player.kill()
+            else:
+                if not scene.player.alive():
+                    scene.player = Ship(scene, scene.players)
+                scene.player.rect.x = x
+                scene.player.dirty = 1
+        if 'score' in fields:
+            scene.scoreTxt.msg = fields['score']
+        if 'lives' in fields:
+            for i, life in enumerate(scene.lives):
+                if i < fields['lives']:
+                    scene.dashGroup.add(life)
+                    scene.add(life)
+                else:
+                    life.kill()
+        if 'mystery' in fields:
+            mystery = next(iter(scene.mysteries), None)
+            if fields['mystery'] is None:
+                if mystery is not None:
+                    mystery.kill()
+            elif mystery is None:
+                Mystery.restore(scene, ['Mystery'] + fields['mystery'])
+            else:
+                mystery.rect.x = fields['mystery'][0]
+                mystery.dirty = 1
+        for name, banner in self.banners.items():
+            if fields.get(name):
+                scene.add(banner)
+            elif name in fields:
+                banner.kill()
+
+    def keyframe(self, view):
+        scene = self.scene
+        scene.enemyPosition = view['enemyPosition']
+        scene.reset()
+        self.clock.tick = view['tick']
+        scene.enemies.restore(view['formation'])
+        for bunker, bits in zip(scene.blockers, view['bunkers']):
+            bunker.restore(bits)
+        self.sprites = {}
+        for state in view['sprites']:
+            self.spawn(state)
+        self.fields(view)
+        self.clock.clear()
+        self.repaint = True
+
+    def render(self, surface):
+        if self.repaint:
+            self.repaint = False
+            self.scene.repaint_rect(surface.get_rect())
+        return self.scene.draw(surface)
+
+
+async def play(session=None, spectate=False, host=HOST, port=PORT):
+    mixer.pre_init(*AUDIO_FORMAT + (AUDIO_BUFFER,))
+    init()
+    audio = NullAudio() if HEADLESS else AudioThread(ASSETS)
+    screen = display.set_mode(DEFAULT_CONFIG.size)
+    display.set_caption('Space Invaders')
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(dumps({'join': session, 'spectate': spectate}))
+    game = RemoteGame(audio=audio)
+    messages = []
+
+    async def receive():
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            messages.append(json.loads(line))
+
+    receiver = asyncio.ensure_future(receive())
+    loop = asyncio.get_running_loop()
+    keys = (False, False)
+    try:
+        while not receiver.done():
+            for evt in event.get():
+                if evt.type == QUIT or (evt.type == KEYDOWN
+                                        and evt.key == K_ESCAPE):
+                    return
+                if evt.type == KEYDOWN and evt.key == K_SPACE:
+                    writer.write(dumps({'fire': 1}))
+            pressed = key.get_pressed()
+            if (pressed[K_LEFT], pressed[K_RIGHT]) != keys:
+                keys = (pressed[K_LEFT], pressed[K_RIGHT])
+                writer.write(dumps({'keys': keys}))
+            for message in messages:
+                game.apply(message)
+            del messages[:]
+            display.update(game.render(screen))
+            await asyncio.sleep(1.0 / 60 - loop.time() % (1.0 / 60))
+    finally:
+        receiver.cancel()
+        writer.close()
+        audio.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Space Invaders client')
+    parser.add_argument('session', nargs='?',
+                        help='session to join, a new one if not given')
+    parser.add_argument('--spectate', action='store_true')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    try:
+        asyncio.run(play(args.session, args.spectate, args.host, args.port))
+    except (ConnectionError, KeyboardInterrupt) as e:
+        sys.exit(str(e) if isinstance(e, ConnectionError) else 0)
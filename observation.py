@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# Compact observations of a GameScene for agents, instead of its pixels:
+#   python observation.py    compare their cost with rendering frames
+
+import sys
+from timeit import default_timer
+
+import numpy as np
+
+MAX_ENEMY_BULLETS = 32  # Slots kept when the config does not cap them
+EMPTY = -1  # x and y of an unused bullet slot
+# Gray levels of sketch()
+SHIP, ENEMY, BLOCKER, MYSTERY = 255, 200, 120, 220
+LASER, ENEMY_LASER = 255, 160
+
+
+class ObservationEncoder(object):
+    """Lays out a game's state as one int32 vector of fixed size:
+
+    score, lives         1 each
+    ship                 x, y, alive
+    swarm                x, y, direction of the formation
+    mystery              x, alive
+    enemies              rows x columns, 1 while alive
+    blockers             bunkers x rows x columns, 1 while intact
+    bullets              x, y of each player bullet, EMPTY for free slots
+    enemyBullets         the same, lowest first if there are too many
+
+    slices maps every field to its part of the vector.
+    """
+
+    def __init__(self, config, bunker_columns=9, bunker_rows=4):
+        self.config = config
+        self.bunkerShape = (len(config.blockerOffsets), bunker_rows,
+                            bunker_columns)
+        self.bulletSlots = 2 * config.shipBullets
+        self.enemyBulletSlots = config.enemyBullets or MAX_ENEMY_BULLETS
+        self.slices = {}
+        offset = 0
+        for name, size in (('score', 1), ('lives', 1), ('ship', 3),
+                           ('swarm', 3), ('mystery', 2),
+                           ('enemies', config.rows * config.columns),
+                           ('blockers', int(np.prod(self.bunkerShape))),
+                           ('bullets', 2 * self.bulletSlots),
+                           ('enemyBullets', 2 * self.enemyBulletSlots)):
+            self.slices[name] = slice(offset, offset + size)
+            offset += size
+        self.size = offset
+        self._samplings = {}
+        self._bunkers = {}
+
+    @staticmethod
+    def _bitmap(ints, width):
+        """uint8 array with bit n of ints[i] in [i, n]"""
+        nbytes = (width + 7) // 8
+        data = b''.join(bits.to_bytes(nbytes, 'little') for bits in ints)
+        bytes_ = np.frombuffer(data, np.uint8).reshape(len(ints), nbytes)
+        return np.unpackbits(bytes_, axis=1, bitorder='little')[:, :width]
+
+    def enemies(self, scene):
+        """rows x columns array, 1 while that enemy lives"""
+        group = scene.enemies
+        return self._bitmap(group._rowBits, group.columns)
+
+    def _sampling(self, k, shape, x, y, columns, rows, pitch_x, pitch_y,
+                  w, h):
+        """Where a grid of cells lands on a frame downsampled by k: the
+        frame region, the cell row and column of every region pixel and
+        which of them fall inside a cell"""
+        key_ = (k, shape, x, y, columns, rows, pitch_x, pitch_y, w, h)
+        if key_ not in self._samplings:
+            if len(self._samplings) > 64:
+                self._samplings.clear()
+            top, left = max(0, y // k), max(0, x // k)
+            bottom = min(shape[0], (y + rows * pitch_y - 1) // k + 1)
+            right = min(shape[1], (x + columns * pitch_x - 1) // k + 1)
+            ys = np.arange(top, max(top, bottom)) * k - y
+            xs = np.arange(left, max(left, right)) * k - x
+            inside = (((ys >= 0) & (ys % pitch_y < h))[:, None]
+                      & ((xs >= 0) & (xs % pitch_x < w))[None, :])
+            self._samplings[key_] = (
+                (slice(top, bottom), slice(left, right)),
+                np.clip(ys // pitch_y, 0, rows - 1)[:, None],
+                np.clip(xs // pitch_x, 0, columns - 1)[None, :],
+                inside.view(np.uint8))
+        return self._samplings[key_]
+
+    def _grid(self, out, k, x, y, cells, pitch_x, pitch_y, w, h, level):
+        """Draw the cells set in the rows x columns array cells, w x h
+        pixels each, every pitch_x, pitch_y from (x, y)"""
+        rows, columns = cells.shape
+        region, row_of, column_of, inside = self._sampling(
+            k, out.shape, x, y, columns, rows, pitch_x, pitch_y, w, h)
+        hit = cells[row_of, column_of] & inside
+        out[region][hit.view(bool)] = level
+
+    def _bunker(self, out, k, bunker):
+        # Bunkers stay put and rarely change, keep what they cover
+        key_ = (k, out.shape, bunker.rect.topleft, tuple(bunker.bits))
+        if key_ not in self._bunkers:
+            if len(self._bunkers) > 64:
+                self._bunkers.clear()
+            cell = bunker.cell
+            region, row_of, column_of, inside = self._sampling(
+                k, out.shape, bunker.rect.x, bunker.rect.y, bunker.columns,
+                bunker.rows, cell, cell, cell, cell)
+            cells = self._bitmap(bunker.bits, bunker.rows).T
+            hit = cells[row_of, column_of] & inside
+            self._bunkers[key_] = region, hit.view(bool)
+        region, hit = self._bunkers[key_]
+        out[region][hit] = BLOCKER
+
+    def _bullets(self, out, bullets, slots):
+        bullets = bullets.sprites()
+        if len(bullets) > slots:
+            bullets.sort(key=lambda b: -b.rect.y)
+            bullets = bullets[:slots]
+        out[:] = EMPTY
+        for i, bullet in enumerate(bullets):
+            out[2 * i:2 * i + 2] = bullet.rect.topleft
+
+    def encode(self, scene, out=None):
+        if out is None:
+            out = np.empty(self.size, np.int32)
+        s = self.slices
+        player = scene.player
+        mystery = next(iter(scene.mysteries), None)
+        group = scene.enemies
+        out[s['score']] = scene.scoreTxt.msg
+        out[s['lives']] = sum(1 for life in (scene.life1, scene.life2,
+                                             scene.life3) if life.alive())
+        out[s['ship']] = player.rect.x, player.rect.y, player.alive()
+        out[s['swarm']] = group.x, group.y, group.direction
+        out[s['mystery']] = (mystery.rect.x, 1) if mystery else (0, 0)
+        out[s['enemies']] = self.enemies(scene).ravel()
+        blockers = out[s['blockers']].reshape(self.bunkerShape)
+        bunkers = scene.blockers.sprites()
+        if bunkers:
+            count, rows, columns = self.bunkerShape
+            cells = self._bitmap([bits for bunker in bunkers
+                                  for bits in bunker.bits], rows)
+            blockers[:] = cells.reshape(count, columns,
+                                        rows).transpose(0, 2, 1)
+        else:
+            blockers[:] = 0
+        self._bullets(out[s['bullets']], scene.bullets, self.bulletSlots)
+        self._bullets(out[s['enemyBullets']], scene.enemyBullets,
+                      self.enemyBulletSlots)
+        return out
+
+    def sketch(self, scene, downsample=4, out=None):
+        """Gray frame downsampled by an integer factor, drawn straight from
+        the state as flat boxes instead of blitting sprites"""
+        config = self.config
+        k = downsample
+        if out is None:
+            out = np.empty((config.height // k, config.width // k), np.uint8)
+        out[:] = 0
+
+        def box(rect, level):
+            left, top = max(0, rect.left // k), max(0, rect.top // k)
+            out[top:(rect.bottom - 1) // k + 1,
+                left:(rect.right - 1) // k + 1] = level
+
+        # The formation and the bunkers are grids, sampled per pixel
+        group = scene.enemies
+        self._grid(out, k, group.x, group.y, self.enemies(scene),
+                   50, 45, 40, 35, ENEMY)
+        for bunker in scene.blockers:
+            self._bunker(out, k, bunker)
+        if scene.player.alive():
+            box(scene.player.rect, SHIP)
+        for mystery in scene.mysteries:
+            box(mystery.rect, MYSTERY)
+        for bullet in scene.bullets:
+            box(bullet.rect, LASER)
+        for bullet in scene.enemyBullets:
+            box(bullet.rect, ENEMY_LASER)
+        return out
+
+
+def compare(ticks=600, downsample=4):
+    """Microseconds per step to observe a game as pixels or as state"""
+    from pygame import Surface, surfarray, transform
+    from spaceinvaders import HeadlessGame
+
+    game = HeadlessGame(seed=0)
+    game.reset()
+    scene = game.gameScene
+    screen = Surface(game.config.size)
+    small = Surface((game.config.width // downsample,
+                     game.config.height // downsample))
+    state = np.empty(scene.encoder.size, np.int32)
+    sketch = np.empty(small.get_size()[::-1], np.uint8)
+
+    def pixels():
+        game.render(screen)
+        transform.scale(screen, small.get_size(), small)
+        return surfarray.array3d(small)
+
+    results = {}
+    for name, observe in (('pixels', pixels),
+                          ('state', lambda: scene.observe(state)),
+                          ('sketch', lambda: scene.observe_frame(
+                              downsample, sketch))):
+        elapsed = 0.0
+        for tick in range(ticks):
+            game.step((tick // 120 % 2 == 1, tick // 120 % 2 == 0, True))
+            start = default_timer()
+            observe()
+            elapsed += default_timer() - start
+        results[name] = elapsed / ticks * 1e6
+    return results
+
+
+if __name__ == '__main__':
+    results = compare(*map(int, sys.argv[1:]))
+    for name, us in sorted(results.items()):
+        print('%-8s %8.1f us/step' % (name, us))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# Frame-time profiling of SpaceInvaders.main:
+#   python spaceinvaders.py --profile frames.csv
+#   python profiler.py frames.csv
+
+import csv
+import json
+import sys
+from collections import deque
+from timeit import default_timer
+
+# Where each frame goes, in ms. 'collisions' is part of 'update'.
+PHASES = ('poll', 'events', 'update', 'collisions', 'draw', 'display')
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Profiler(object):
+    """Phase timings and counters for every frame, kept in memory and
+    written to path (.csv or .json) on close()"""
+
+    def __init__(self, path=None, window=300):
+        self.path = path
+        self.frames = []
+        self.recent = deque(maxlen=window)
+        self._frame = None
+        self._start = self._last = 0.0
+
+    def begin(self):
+        self._start = self._last = default_timer()
+        self._frame = dict.fromkeys(PHASES, 0.0)
+
+    def mark(self, phase):
+        """Charge the time since the previous mark to phase"""
+        now = default_timer()
+        self._frame[phase] += (now - self._last) * 1000.0
+        self._last = now
+
+    def timed(self, phase, func):
+        """Wrap func to charge its calls to phase"""
+        def wrapper(*args, **kwargs):
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._frame[phase] += (default_timer() - start) * 1000.0
+        return wrapper
+
+    def end(self, **counters):
+        frame = self._frame
+        frame['frame'] = (default_timer() - self._start) * 1000.0
+        frame.update(counters)
+        self.frames.append(frame)
+        self.recent.append(frame)
+
+    def summary(self, frames=None):
+        """p50 and p99 of every timing and counter"""
+        frames = self.frames if frames is None else frames
+        fields = []
+        for frame in frames:
+            fields.extend(name for name in frame if name not in fields)
+        return {name: {'p50': percentile([f.get(name, 0) for f in frames],
+                                         0.5),
+                       'p99': percentile([f.get(name, 0) for f in frames],
+                                         0.99)}
+                for name in fields}
+
+    def overlay(self):
+        """One line of recent statistics for the on-screen overlay"""
+        stats = self.summary(self.recent)
+        return ('frame %.1f/%.1f ms  upd %.1f  col %.2f  draw %.1f  '
+                'rects %d' % (stats['frame']['p50'], stats['frame']['p99'],
+                              stats['update']['p50'],
+                              stats['collisions']['p50'],
+                              stats['draw']['p50'], stats['rects']['p50']))
+
+    def dump(self, path):
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump({'summary': self.summary(), 'frames': self.frames},
+                          f)
+            return
+        fields = []
+        for frame in self.frames:
+            fields.extend(name for name in frame if name not in fields)
+        with open(path, 'w') as f:
+            writer = csv.DictWriter(f, fields, restval=0)
+            writer.writeheader()
+            writer.writerows(self.frames)
+
+    def close(self):
+        if self.path:
+            self.dump(self.path)
+
+
+def load(path):
+    if path.endswith('.json'):
+        with open(path) as f:
+            return json.load(f)['frames']
+    with open(path) as f:
+        return [{name: float(value) for name, value in row.items()}
+                for row in csv.DictReader(f)]
+
+
+if __name__ == '__main__':
+    profiler = Profiler()
+    profiler.frames = load(sys.argv[1])
+    summary = profiler.summary()
+    width = max(len(name) for name in summary)
+    print('%-*s %10s %10s' % (width, '', 'p50', 'p99'))
+    for name, stats in summary.items():
+        print('%-*s %10.2f %10.2f' % (width, name, stats['p50'],
+                                      stats['p99']))
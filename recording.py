@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# Compact recordings of played games, replayed headless to check scores:
+#   python spaceinvaders.py --record games.sir
+#   python recording.py games.sir
+
+import json
+import struct
+import sys
+import time
+import zlib
+from itertools import groupby
+
+MAGIC = b'SIR2'
+# magic, game seed, start tick, mystery velocity, final score, ticks,
+# length of the GameConfig settings as JSON, length of the compressed inputs
+HEADER = struct.Struct('<4sIQbIIII')
+# The recordings before, played with the default config and without settings
+MAGIC_V1 = b'SIR1'
+HEADER_V1 = struct.Struct('<4sIQbIII')
+
+
+def encode(inputs):
+    """Run-length encode (left, right, fire) ticks as varints of
+    run << 3 | state, then deflate"""
+    out = bytearray()
+    for (left, right, fire), run in groupby(inputs):
+        value = sum(1 for _ in run) << 3 | left | right << 1 | fire << 2
+        while value > 0x7f:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+    return zlib.compress(bytes(out), 9)
+
+
+def decode(data):
+    value = shift = 0
+    for byte in bytearray(zlib.decompress(data)):
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte & 0x80:
+            continue
+        state = (bool(value & 1), bool(value & 2), bool(value & 4))
+        for _ in range(value >> 3):
+            yield state
+        value = shift = 0
+
+
+class Recording(object):
+    def __init__(self, seed, start, velocity, score=0, inputs=None,
+                 settings=None):
+        self.seed = seed
+        self.start = start
+        self.velocity = velocity
+        self.score = score
+        self.inputs = inputs if inputs is not None else []
+        self.settings = settings or {}  # GameConfig keyword arguments
+
+    def dump(self):
+        settings = json.dumps(self.settings, separators=(',', ':')).encode()
+        data = encode(self.inputs)
+        return HEADER.pack(MAGIC, self.seed, self.start, self.velocity,
+                           self.score, len(self.inputs), len(settings),
+                           len(data)) + settings + data
+
+
+def load(path):
+    """Recordings stored in path, in the order they were played"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        magic = data[offset:offset + 4]
+        settings = {}
+        if magic == MAGIC:
+            magic, seed, start, velocity, score, ticks, length, size = \
+                HEADER.unpack_from(data, offset)
+            offset += HEADER.size
+            settings = json.loads(data[offset:offset + length].decode())
+            offset += length
+        elif magic == MAGIC_V1:
+            magic, seed, start, velocity, score, ticks, size = \
+                HEADER_V1.unpack_from(data, offset)
+            offset += HEADER_V1.size
+        else:
+            raise ValueError('%s: not a Space Invaders recording' % path)
+        inputs = list(decode(data[offset:offset + size]))
+        if len(inputs) != ticks:
+            raise ValueError('%s: truncated recording' % path)
+        offset += size
+        yield Recording(seed, start, velocity, score, inputs, settings)
+
+
+class Recorder(object):
+    """Collects the per-tick input of the games SpaceInvaders runs and
+    appends each one to a file when it is over"""
+
+    def __init__(self, path):
+        self.path = path
+        self.recording = None
+
+    def start(self, seed, tick, velocity, config):
+        self.recording = Recording(seed, tick, velocity,
+                                   settings=config.settings())
+
+    def record(self, left, right, fire):
+        if self.recording:
+            self.recording.inputs.append(
+                (bool(left), bool(right), bool(fire)))
+
+    def stop(self, score):
+        if self.recording:
+            self.recording.score = score
+            with open(self.path, 'ab') as f:
+                f.write(self.recording.dump())
+            self.recording = None
+
+
+def replay(recording):
+    """Run a recording through HeadlessGame, returning its last state"""
+    from spaceinvaders import GameConfig, HeadlessGame
+
+    game = HeadlessGame(recording.seed, GameConfig(**recording.settings))
+    game.clock.tick = recording.start
+    game.gameScene.mysteryVelocity = recording.velocity
+    state = game.reset()
+    for inputs in recording.inputs:
+        state = game.step(inputs)
+    return state
+
+
+if __name__ == '__main__':
+    failed = 0
+    for i, recording in enumerate(load(sys.argv[1]), 1):
+        start = time.time()
+        state = replay(recording)
+        ok = state['over'] and state['score'] == recording.score
+        failed += not ok
+        print('game %d: %d ticks, score %d, replayed %d in %.2fs %s'
+              % (i, len(recording.inputs), recording.score, state['score'],
+                 time.time() - start, 'ok' if ok else 'MISMATCH'))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# HeadlessGames served over TCP, streamed to their player and spectators as
+# per-tick deltas instead of frames:
+#   python server.py                 serve on PORT
+#   python client.py [SESSION]       play a session, or watch with --spectate
+#   python server.py --load 200      measure sessions per core
+
+import asyncio
+import json
+import sys
+from argparse import ArgumentParser
+from itertools import count
+from random import Random
+from timeit import default_timer
+
+from spaceinvaders import TICK_RATE, HeadlessGame
+
+HOST = '127.0.0.1'
+PORT = 8765
+MAX_CATCHUP = 5  # Ticks run at once after a stall, beyond that time slips
+MAX_BUFFER = 1 << 20  # Bytes queued to a client before it is dropped
+# Errors of a malformed message, after which its client is dropped
+BAD_MESSAGE = (ValueError, TypeError, KeyError, AttributeError)
+
+
+def dumps(message):
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+class Session(object):
+    """One HeadlessGame, the input of its player and the deltas that tell
+    its subscribers what changed each tick:
+
+    tick        the tick sprites were updated at, if the round is on
+    swarm       x, y and frame of the formation once it moved
+    kills       row, column of the enemies killed
+    cells       bunker, column, row of the blocker cells lost
+    spawn       [serial] + snapshot() of the bullets and explosions spawned
+    gone        serials of those that left
+    ship        x, or None once destroyed
+    mystery     x, score, tick it last moved, or None once gone
+    score, lives, nextRound, over
+
+    A keyframe, {'view': ...}, holds the whole state for a new subscriber
+    or a new round.
+    """
+
+    def __init__(self, name, seed=None):
+        self.name = name
+        self.game = HeadlessGame(seed)
+        self.game.reset()
+        self.keys = (False, False)
+        self.fire = False
+        self.player = None
+        self.subscribers = set()
+        self._sync()
+
+    def _pooled(self):
+        scene = self.game.gameScene
+        return [sprite for sprite in scene.sprites()
+                if hasattr(sprite, 'serial')]
+
+    def _mystery(self):
+        mystery = next(iter(self.game.gameScene.mysteries), None)
+        return mystery and [mystery.rect.x, mystery.score, mystery.moved]
+
+    def _sync(self):
+        """Take the current state as the base of the next delta"""
+        game = self.game
+        scene = game.gameScene
+        self.enemies = scene.enemies
+        self.rowBits = list(scene.enemies._rowBits)
+        self.swarm = (scene.enemies.x, scene.enemies.y,
+                      scene.enemies.swarm.frame)
+        self.bunkers = [list(bunker.bits) for bunker in scene.blockers]
+        self.serials = {sprite.serial for sprite in self._pooled()}
+        self.fields = self._fields()
+        self.round = game.round
+
+    def _fields(self):
+        scene = self.game.gameScene
+        player = scene.player
+        return {'ship': player.rect.x if player.alive() else None,
+                'score': scene.scoreTxt.msg,
+                'lives': sum(1 for life in scene.lives if life.alive()),
+                'mystery': self._mystery(),
+                'nextRound': self.game.scene is not scene,
+                'over': self.game.over}
+
+    def keyframe(self):
+        scene = self.game.gameScene
+        view = dict(self._fields(), tick=self.game.clock.tick,
+                    enemyPosition=scene.enemyPosition,
+                    formation=scene.enemies.snapshot(),
+                    bunkers=[bunker.bits for bunker in scene.blockers],
+                    sprites=[[sprite.serial] + list(sprite.snapshot())
+                             for sprite in self._pooled()])
+        return {'view': view}
+
+    def input(self, message):
+        if 'keys' in message:
+            self.keys = tuple(bool(key_) for key_ in message['keys'][:2])
+        if message.get('fire'):
+            self.fire = True
+        if message.get('reset'):
+            self.game.reset()
+            self._sync()
+            self.publish(dumps(self.keyframe()))
+
+    def step(self):
+        """Play a tick and return what changed, encoded"""
+        game = self.game
+        scene = game.gameScene
+        updated = game.scene is scene and not game.over
+        tick = game.clock.tick
+        game.step(self.keys + (self.fire,))
+        self.fire = False
+        if game.round != self.round or scene.enemies is not self.enemies:
+            self._sync()
+            return dumps(self.keyframe())
+
+        delta = {}
+        if updated:
+            delta['tick'] = tick
+        enemies = scene.enemies
+        swarm = (enemies.x, enemies.y, enemies.swarm.frame)
+        if swarm != self.swarm:
+            self.swarm = delta['swarm'] = swarm
+        kills = []
+        rows = zip(self.rowBits, enemies._rowBits)
+        for row, (old, new) in enumerate(rows):
+            lost = old & ~new
+            while lost:
+                kills.append((row, (lost & -lost).bit_length() - 1))
+                lost &= lost - 1
+            self.rowBits[row] = new
+        if kills:
+            delta['kills'] = kills
+        cells = []
+        for i, bunker in enumerate(scene.blockers):
+            old = self.bunkers[i]
+            if old == bunker.bits:
+                continue
+            for column, (was, now) in enumerate(zip(old, bunker.bits)):
+                lost = was & ~now
+                cells.extend((i, column, row) for row in range(bunker.rows)
+                             if lost >> row & 1)
+            self.bunkers[i] = list(bunker.bits)
+        if cells:
+            delta['cells'] = cells
+        pooled = self._pooled()
+        serials = {sprite.serial for sprite in pooled}
+        if serials != self.serials:
+            spawned = [[sprite.serial] + list(sprite.snapshot())
+                       for sprite in pooled
+                       if sprite.serial not in self.serials]
+            if spawned:
+                delta['spawn'] = spawned
+            gone = self.serials - serials
+            if gone:
+                delta['gone'] = sorted(gone)
+            self.serials = serials
+        fields = self._fields()
+        for name, value in fields.items():
+            if value != self.fields[name]:
+                delta[name] = value
+        self.fields = fields
+        return dumps(delta)
+
+    def publish(self, data):
+        for writer in list(self.subscribers):
+            if writer.transport.is_closing():
+                self.subscribers.discard(writer)
+            elif writer.transport.get_write_buffer_size() > MAX_BUFFER:
+                self.subscribers.discard(writer)  # Too slow to keep up
+                writer.close()
+            else:
+                writer.write(data)
+
+
+class GameServer(object):
+    """Sessions stepped together at TICK_RATE on one event loop. A client
+    sends a JSON line {"join": name, "spectate": false, "seed": null}, then
+    {"keys": [left, right]}, {"fire": 1} or {"reset": 1} as a player, and
+    reads one JSON line per tick."""
+
+    def __init__(self, seed=None):
+        self.sessions = {}
+        self.random = Random(seed)
+        self.names = count(1)
+        self.busy = 0.0  # Seconds spent stepping and encoding sessions
+        self.ticks = self.sessionTicks = self.late = 0
+        self.sent = 0
+
+    async def handle(self, reader, writer):
+        line = await reader.readline()
+        if not line:
+            writer.close()
+            return
+        try:
+            hello = json.loads(line)
+            name = hello.get('join') or 'game%d' % next(self.names)
+            session = self.sessions.get(name)
+            if session is None:
+                seed = hello.get('seed')
+                if seed is None:
+                    seed = self.random.getrandbits(32)
+                session = self.sessions[name] = Session(name, seed)
+        except BAD_MESSAGE:
+            writer.close()
+            return
+        if session.player is None and not hello.get('spectate'):
+            session.player = writer
+        writer.write(dumps(dict(session.keyframe(), session=name,
+                                player=session.player is writer)))
+        session.subscribers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if session.player is writer:
+                    session.input(json.loads(line))
+        except (ConnectionError,) + BAD_MESSAGE:
+            pass
+        finally:
+            session.subscribers.discard(writer)
+            if session.player is writer:
+                session.player = None
+                session.keys = (False, False)
+            if not session.subscribers:
+                self.sessions.pop(name, None)
+            writer.close()
+
+    def tick(self):
+        start = default_timer()
+        for session in list(self.sessions.values()):
+            data = session.step()
+            session.publish(data)
+            self.sent += len(data) * len(session.subscribers)
+        self.busy += default_timer() - start
+        self.ticks += 1
+        self.sessionTicks += len(self.sessions)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / TICK_RATE
+        due = loop.time()
+        while True:
+            ticks = 0
+            while loop.time() >= due and ticks < MAX_CATCHUP:
+                self.tick()
+                due += period
+                ticks += 1
+            if loop.time() >= due:
+                self.late += 1
+                due = loop.time()
+            await asyncio.sleep(due - loop.time())
+
+    def stats(self):
+        per_tick = self.busy / max(1, self.sessionTicks)
+        return {'sessions': len(self.sessions), 'ticks': self.ticks,
+                'late': self.late, 'usPerSessionTick': per_tick * 1e6,
+                'sessionsPerCore': 1.0 / (per_tick * TICK_RATE)
+                if per_tick else 0.0,
+                'bytesPerSessionTick': self.sent / max(1, self.sessionTicks)}
+
+
+async def serve(host=HOST, port=PORT):
+    server = GameServer()
+    listener = await asyncio.start_server(server.handle, host, port)
+    async with listener:
+        await server.run()
+
+
+async def bot(port, name, seconds, seed):
+    """A player pressing random keys that reads, but does not decode, the
+    stream"""
+    random = Random(seed)
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(dumps({'join': name, 'seed': seed}))
+    loop = asyncio.get_running_loop()
+    end = loop.time() + seconds
+    received = 0
+    while loop.time() < end:
+        line = await reader.readline()
+        if not line:
+            break
+        received += len(line)
+        if random.random() < 0.1:
+            writer.write(dumps({'keys': [random.random() < 0.5,
+                                         random.random() < 0.5],
+                                'fire': random.random() < 0.5}))
+    writer.close()
+    return received
+
+
+async def load_test(sessions=100, seconds=10.0):
+    """Play sessions bot games for seconds on one server; the stats of the
+    server and the tick rate it kept"""
+    server = GameServer(seed=0)
+    listener = await asyncio.start_server(server.handle, HOST, 0)
+    port = listener.sockets[0].getsockname()[1]
+    ticker = asyncio.ensure_future(server.run())
+    start = default_timer()
+    received = await asyncio.gather(*[
+        bot(port, 'bot%d' % i, seconds, i) for i in range(sessions)])
+    elapsed = default_timer() - start
+    ticker.cancel()
+    listener.close()
+    stats = server.stats()
+    stats['tickRate'] = server.ticks / elapsed
+    stats['received'] = sum(received)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Space Invaders server')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--load', type=int, metavar='SESSIONS',
+                        help='run SESSIONS bot games and report the load')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+    if args.load:
+        stats = asyncio.run(load_test(args.load, args.seconds))
+        print('%d sessions: %.1f ticks/s (target %d), %.0f us per session '
+              'tick, %.0f B per session tick, %d late'
+              % (args.load, stats['tickRate'], TICK_RATE,
+                 stats['usPerSessionTick'], stats['bytesPerSessionTick'],
+                 stats['late']))
+        print('sessions per core at %d Hz: %.0f'
+              % (TICK_RATE, stats['sessionsPerCore']))
+        sys.exit()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
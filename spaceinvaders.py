@@ -3,25 +3,41 @@
 # Space Invaders
 # Created by Lee Robinson
 
+import json
+import struct
 import sys
-from itertools import cycle
-from os.path import abspath, dirname
-from random import choice
-
-from pygame import display, event, font, image, init, key, \
-    mixer, time, transform, Surface
-from pygame.constants import QUIT, KEYDOWN, KEYUP, USEREVENT, \
-    K_ESCAPE, K_LEFT, K_RIGHT, K_SPACE
+from argparse import ArgumentParser
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
+from itertools import count
+from math import ceil, sqrt
+from os import environ, stat
+from os.path import abspath, dirname, exists
+from queue import SimpleQueue
+from random import Random
+from threading import Thread
+from time import process_time, sleep
+from timeit import default_timer
+from warnings import warn
+
+from pygame import display, error, event, font, image, init, key, \
+    mixer, time, transform, Rect, Surface
+from pygame.constants import QUIT, KEYDOWN, KEYUP, SRCALPHA, USEREVENT, \
+    BLEND_RGBA_MAX, K_ESCAPE, K_LEFT, K_RIGHT, K_SPACE, SCALED
 from pygame.event import Event
-from pygame.mixer import Sound
-from pygame.sprite import groupcollide, Group, DirtySprite, LayeredDirty
+from pygame.mixer import Channel, Sound
+from pygame.sprite import groupcollide, Group, DirtySprite, LayeredDirty, \
+    Sprite
 
 DEBUG = True
+# Run without a window or sound card, e.g. for AI training
+HEADLESS = bool(environ.get('SPACEINVADERS_HEADLESS'))
 
 BASE_PATH = abspath(dirname(__file__))
 FONT_PATH = BASE_PATH + '/fonts/'
 IMAGE_PATH = BASE_PATH + '/images/'
 SOUND_PATH = BASE_PATH + '/sounds/'
+BUNDLE_PATH = BASE_PATH + '/assets.bundle'
 
 # Colors (R, G, B)
 WHITE = (255, 255, 255)
@@ -31,8 +47,10 @@ BLUE = (80, 255, 239)
 PURPLE = (203, 0, 255)
 RED = (237, 28, 36)
 
-SCREEN = display.set_mode((800, 600))
-BACKGROUND = image.load(IMAGE_PATH + 'background.jpg').convert()
+if HEADLESS:
+    environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
 FONT = FONT_PATH + 'space_invaders.ttf'
 IMG_NAMES = ['ship', 'mystery',
              'enemy1_1', 'enemy1_2',
@@ -40,21 +58,404 @@ IMG_NAMES = ['ship', 'mystery',
              'enemy3_1', 'enemy3_2',
              'explosionblue', 'explosiongreen', 'explosionpurple',
              'laser', 'enemylaser']
-IMAGES = {name: image.load(IMAGE_PATH + '{}.png'.format(name)).convert_alpha()
-          for name in IMG_NAMES}
+SOUND_NAMES = ['shoot', 'shoot2', 'invaderkilled', 'mysterykilled',
+               'shipexplosion', 'mysteryentered', 0, 1, 2, 3]
+# magic, mixer frequency, sample size and channels the sounds were decoded for
+BUNDLE_HEADER = struct.Struct('<4sIiI')
+BUNDLE_MAGIC = b'SIB2'
+# kind, name length, width, height, data length, and the mtime in ns and
+# size of the source file it was made from
+BUNDLE_ENTRY = struct.Struct('<BHIIIqQ')
+BUNDLE_IMAGE, BUNDLE_ALPHA, BUNDLE_SOUND = range(3)
 
 BLOCKERS_POSITION = 450
+BLOCKER_CELL = 10  # Size of the pieces blockers erode in
 ENEMY_DEFAULT_POSITION = 65  # Initial value for a new game
 ENEMY_MOVE_DOWN = 35
 EVENT_SHIP_CREATE = USEREVENT + 0
 EVENT_ENEMY_SHOOT = USEREVENT + 1
 EVENT_ENEMY_MOVE_NOTE = USEREVENT + 2
 EVENT_MYSTERY = USEREVENT + 3
+FIRE_EVENT = Event(KEYDOWN, key=K_SPACE)  # What HeadlessGame posts to fire
+TICK_RATE = 60  # Fixed simulation ticks per second
+TICK_TIME = 1000.0 / TICK_RATE
+MOVE_TICKS = 2  # Ticks between the steps of the ship, bullets and mystery
+MAX_TICKS_PER_FRAME = 5  # Beyond this the game slows down instead
+TIMER_SLOTS = 256  # Ticks a turn of the TimerWheel spans
+DAMAGE_TILE = 64  # Side of the tiles DamageGrid buckets rects by
+BLIT_SAMPLES = 256  # Blits timed to measure what a blit call costs
+MAX_STALE = 32  # Rects a scene keeps to repaint on entry, beyond it one
+IDLE_BUDGET = 0.008  # Seconds of a frame deferred work may run until
+FRAME_RATE = 60  # Frames per second while anything moves, 0 for no limit
+IDLE_WAIT = 1000  # Most ms a frame that drew nothing waits for input
+IDLE_POLL = 0.02  # Seconds between input polls while waiting
+# Mixer format. The game loop no longer calls into the mixer, so a smaller
+# buffer than the 4096 it used to need against ALSA underruns will do.
+AUDIO_FORMAT = (44100, -16, 1)
+AUDIO_BUFFER = 1024
+VOICES = 8  # Sounds playing at once
+VOICES_PER_SOUND = 2
+
+
+class GameConfig(object):
+    """Sizes and rates of a game, the original ones unless given as keyword
+    arguments or loaded from a JSON file"""
+    width = 800
+    height = 600
+    columns = 10  # Enemy grid
+    rows = 5
+    enemyX = 154  # Left of the formation, it moves enemyMoves * 10 px
+    enemyMoves = 30
+    moveTime = 600  # ms between swarm steps
+    speedCurve = ((1, 200), (10, 400))  # (enemies left, moveTime), fewest
+    enemyFireTime = 700  # ms between enemy shots
+    enemyBullets = 0  # Enemy bullets in flight at most, 0 for no limit
+    enemyShooters = 1  # Enemies firing at once, from different columns
+    enemyAim = 0.0  # Odds that a shot comes from the column nearest the ship
+    shipBullets = 1  # The ship fires again once fewer are in flight
+    doubleShotScore = 1000  # Two bullets a shot from this score on
+    mysteryTime = 25000
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            if not hasattr(GameConfig, name):
+                raise TypeError('Unknown game setting %r' % name)
+            setattr(self, name, value)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def scaled(cls, factor, **kwargs):
+        """factor times the enemies, in an arena grown to keep the original
+        margins, with faster fire to match"""
+        side = sqrt(factor)
+        columns = int(round(10 * side))
+        rows = int(round(5 * side))
+        settings = dict(columns=columns, rows=rows,
+                        width=columns * 50 + 300, height=rows * 45 + 375,
+                        speedCurve=((1, 200), (int(10 * factor), 400)),
+                        enemyFireTime=max(20, int(700 / side)),
+                        shipBullets=max(1, int(round(side))))
+        settings.update(kwargs)
+        return cls(**settings)
+
+    def settings(self):
+        """The settings this config was made with, as keyword arguments"""
+        return dict(vars(self))
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def shipY(self):
+        return self.height - 60
+
+    @property
+    def blockersPosition(self):
+        return self.height - (600 - BLOCKERS_POSITION)
+
+    @property
+    def blockerOffsets(self):
+        return [50 + i * 200 for i in range(self.width // 200)]
+
+    def center(self, x, y):
+        """(x, y) laid out for 800x600, moved to the middle of the arena"""
+        return x + (self.width - 800) // 2, y + (self.height - 600) // 2
+
+
+DEFAULT_CONFIG = GameConfig()
+
+
+class Assets(object):
+    """Images and sounds, loaded on first use and shared by every scene.
+
+    Reads from the precompiled bundle at BUNDLE_PATH when there is one,
+    otherwise decodes the files in images/ and sounds/, as it does for the
+    files changed since the bundle was made. Images are only converted to
+    the display format once a window is open.
+    """
+
+    def __init__(self, bundle=BUNDLE_PATH):
+        self.bundle = bundle
+        self._entries = None
+        self._images = {}
+        self._sounds = {}
+
+    def _bundled(self, name, kind):
+        if self._entries is None:
+            self._entries = self._read_bundle()
+        entry = self._entries.get((kind, name))
+        if kind == BUNDLE_SOUND and entry and entry[0] != mixer.get_init():
+            return None  # Decoded for another mixer format
+        return entry
+
+    def _read_bundle(self):
+        entries = {}
+        if not self.bundle or not exists(self.bundle):
+            return entries
+        with open(self.bundle, 'rb') as f:
+            data = f.read()
+        magic, freq, size, channels = BUNDLE_HEADER.unpack_from(data)
+        if magic != BUNDLE_MAGIC:
+            warn('%s is from another version, rebuild it with --bundle'
+                 % self.bundle)
+            return entries
+        offset = BUNDLE_HEADER.size
+        stale = []
+        while offset < len(data):
+            kind, length, w, h, nbytes, mtime, source_size = \
+                BUNDLE_ENTRY.unpack_from(data, offset)
+            offset += BUNDLE_ENTRY.size
+            name = data[offset:offset + length].decode()
+            offset += length
+            pixels = data[offset:offset + nbytes]
+            offset += nbytes
+            path = self.source(kind, name)
+            if exists(path) and self.stamp(path) != (mtime, source_size):
+                stale.append(path)  # Decoded from the edited file instead
+            elif kind == BUNDLE_SOUND:
+                entries[kind, name] = ((freq, size, channels), pixels)
+            else:
+                entries[kind, name] = ((w, h), pixels)
+        if stale:
+            warn('%s is older than %s, rebuild it with --bundle'
+                 % (self.bundle, ', '.join(stale)))
+        return entries
+
+    @staticmethod
+    def source(kind, name):
+        """The file a bundle entry is made from"""
+        if kind == BUNDLE_SOUND:
+            return SOUND_PATH + name + '.wav'
+        if kind == BUNDLE_IMAGE:
+            return IMAGE_PATH + name + '.jpg'
+        return IMAGE_PATH + name + '.png'
+
+    @staticmethod
+    def stamp(path):
+        info = stat(path)
+        return info.st_mtime_ns, info.st_size
+
+    def _load_image(self, name, filename, alpha):
+        kind = BUNDLE_ALPHA if alpha else BUNDLE_IMAGE
+        entry = self._bundled(name, kind)
+        if entry:
+            img = image.frombytes(entry[1], entry[0],
+                                  'RGBA' if alpha else 'RGBX')
+        else:
+            img = image.load(filename)
+        if display.get_surface():
+            return img.convert_alpha() if alpha else img.convert()
+        # No display format yet, copy to the default one that off-screen
+        # surfaces use, as blits between different pixel layouts are slow
+        if alpha:
+            converted = Surface(img.get_size(), SRCALPHA)
+            converted.blit(img, (0, 0), special_flags=BLEND_RGBA_MAX)
+        else:
+            converted = Surface(img.get_size())
+            converted.blit(img, (0, 0))
+        return converted
+
+    def image(self, name):
+        if name not in self._images:
+            self._images[name] = self._load_image(
+                name, IMAGE_PATH + '{}.png'.format(name), True)
+        return self._images[name]
+
+    def preload(self, size=(800, 600)):
+        """Load every image now rather than on first use mid-game"""
+        for name in IMG_NAMES:
+            self.image(name)
+        self.background(size)
+
+    def background(self, size=(800, 600)):
+        if size not in self._images:
+            img = self._images.get((800, 600))
+            if img is None:
+                img = self._load_image(
+                    'background', IMAGE_PATH + 'background.jpg', False)
+            if img.get_size() != size:
+                img = transform.smoothscale(img, size)
+            self._images[size] = img
+        return self._images[size]
+
+    def sound(self, name, volume):
+        name = str(name)
+        if name not in self._sounds:
+            entry = self._bundled(name, BUNDLE_SOUND)
+            if entry:
+                self._sounds[name] = Sound(buffer=entry[1])
+            else:
+                self._sounds[name] = Sound(SOUND_PATH + name + '.wav')
+        sound = self._sounds[name]
+        sound.set_volume(volume)
+        return sound
+
+    def save_bundle(self, path=BUNDLE_PATH):
+        """Write every image as raw pixels and every sound as PCM in the
+        current mixer format"""
+        freq, size, channels = mixer.get_init()
+        with open(path, 'wb') as f:
+            f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, freq, size, channels))
+            entries = [(BUNDLE_IMAGE, 'background')]
+            entries.extend((BUNDLE_ALPHA, name) for name in IMG_NAMES)
+            entries.extend((BUNDLE_SOUND, str(name)) for name in SOUND_NAMES)
+            for kind, name in entries:
+                filename = self.source(kind, name)
+                mtime, source_size = self.stamp(filename)
+                if kind == BUNDLE_SOUND:
+                    asset = Sound(filename)
+                    w = h = 0
+                    data = asset.get_raw()
+                else:
+                    asset = image.load(filename)
+                    w, h = asset.get_size()
+                    data = image.tobytes(
+                        asset, 'RGBA' if kind == BUNDLE_ALPHA else 'RGBX')
+                f.write(BUNDLE_ENTRY.pack(kind, len(name), w, h, len(data),
+                                          mtime, source_size))
+                f.write(name.encode())
+                f.write(data)
+
+
+ASSETS = Assets()
+
+
+class LRUCache(object):
+    """Dict of at most maxsize items, dropping the least recently used"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._items), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hitRate': self.hits / float(lookups) if lookups else 0.0}
+
+
+class Pool(object):
+    """Instances of a Pooled sprite class, reused once killed: reset() in
+    place instead of built again"""
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.objects = []
+        self.free = []
+        self.created = self.reused = 0
+
+    def get(self, *args):
+        if self.free:
+            obj = self.free.pop()
+            obj.reset(*args)
+            self.reused += 1
+        else:
+            obj = self.cls(*args)
+            self.objects.append(obj)
+            self.created += 1
+        return obj
+
+    def put(self, obj):
+        self.free.append(obj)
+
+    def reclaim(self):
+        """Take back the instances that left their groups without kill()"""
+        self.free = [obj for obj in self.objects if not obj.alive()]
+
+    def stats(self):
+        active = len(self.objects) - len(self.free)
+        gets = self.created + self.reused
+        return {'created': self.created, 'reused': self.reused,
+                'active': active, 'free': len(self.free),
+                'reuseRate': self.reused / float(gets) if gets else 0.0}
+
+
+class Pooled(object):
+    """Sprites made with spawn(), which go back to their class' pool when
+    killed. serial is new on every spawn, unlike the instance."""
+    pool = None
+    serials = count()
+
+    @classmethod
+    def spawn(cls, *args):
+        obj = cls.pool.get(*args)
+        obj.serial = next(Pooled.serials)
+        return obj
+
+    def kill(self):
+        alive = self.alive()
+        super(Pooled, self).kill()
+        if alive:
+            self.pool.put(self)
+
+
+class GlyphAtlas(object):
+    """The digits of one font and color rendered once, side by side, to
+    compose numbers from instead of rendering each one"""
+    digits = '0123456789'
+
+    def __init__(self, font_, color_):
+        self.image = font_.render(self.digits, True, color_)
+        self.height = self.image.get_height()
+        self.glyphs = {}
+        x = 0
+        for digit, metrics in zip(self.digits, font_.metrics(self.digits)):
+            advance = metrics[4]
+            self.glyphs[digit] = Rect(x, 0, advance, self.height)
+            x += advance
+
+    def compose(self, prefix, number):
+        """prefix (a rendered Surface or None) followed by number"""
+        width = sum(self.glyphs[digit].w for digit in number)
+        x = prefix.get_width() if prefix else 0
+        img = Surface((x + width, self.height), SRCALPHA)
+        # Copy the pixels, alpha blending onto transparency would darken them
+        if prefix:
+            img.blit(prefix, (0, 0), special_flags=BLEND_RGBA_MAX)
+        for digit in number:
+            area = self.glyphs[digit]
+            img.blit(self.image, (x, 0), area, BLEND_RGBA_MAX)
+            x += area.w
+        return img
+
+
+# What explosions read from the sprite they replace, to restore them
+Source = namedtuple('Source', 'rect kind score')
 
 
 class Txt(DirtySprite):
     font_cache = {}
-    cache = {}
+    atlases = {}
+    cache = LRUCache(256)
 
     def __init__(self, font_, size, msg, color_, x, y, *groups):
         super(Txt, self).__init__(*groups)
@@ -78,75 +479,153 @@ class Txt(DirtySprite):
     msg = property(_get_msg, _set_msg, doc="Message Text")
 
     def _update_image(self):
-        font_key = hash(self._font) + hash(self._size)
+        msg = str(self.msg)
+        key_ = (self._font, self._size, tuple(self._color), msg)
+        img = Txt.cache.get(key_)
+        if img is None:
+            img = self._render(msg)
+            Txt.cache.put(key_, img)
+        rect = img.get_rect(topleft=(self._x, self._y))
+        return img, rect
+
+    def _render(self, msg):
+        font_key = (self._font, self._size)
         if font_key in Txt.font_cache:
             font_ = Txt.font_cache[font_key]
         else:
             font_ = font.Font(self._font, self._size)
             Txt.font_cache[font_key] = font_
 
-        key_ = font_key + hash(self.msg) + hash(self._color)
-        if key_ in Txt.cache:
-            img = Txt.cache[key_]
+        # Counters like the score and "FPS: 60" end in a number
+        prefix = msg.rstrip(GlyphAtlas.digits)
+        number = msg[len(prefix):]
+        if not number:
+            return font_.render(msg, True, self._color)
+        atlas_key = font_key + (tuple(self._color),)
+        if atlas_key in Txt.atlases:
+            atlas = Txt.atlases[atlas_key]
         else:
-            img = font_.render(str(self.msg), True, self._color)
-            Txt.cache[key_] = img
-        rect = img.get_rect(topleft=(self._x, self._y))
-        return img, rect
+            atlas = GlyphAtlas(font_, self._color)
+            Txt.atlases[atlas_key] = atlas
+        prefix_img = None
+        if prefix:
+            # The prefix is rendered, and cached, as text of its own
+            prefix_key = font_key + (tuple(self._color), prefix)
+            prefix_img = Txt.cache.get(prefix_key)
+            if prefix_img is None:
+                prefix_img = font_.render(prefix, True, self._color)
+                Txt.cache.put(prefix_key, prefix_img)
+        return atlas.compose(prefix_img, number)
 
 
 class Img(DirtySprite):
-    cache = {}
+    cache = LRUCache(64)
 
     def __init__(self, filename, x=0, y=0, w=0, h=0, *groups):
-        super(Img, self).__init__(*groups)
+        super(Img, self).__init__()
         self.update_image(filename, x, y, w, h)
+        self.add(*groups)
 
-    def update_image(self, filename, x=0, y=0, w=0, h=0):
-        key_ = hash(filename) + hash(w) + hash(h)
-        if key_ in Img.cache:
-            self.image = Img.cache[key_]
-        else:
-            self.image = IMAGES[filename]
+    @staticmethod
+    def surface(filename, w=0, h=0):
+        """The image of filename, scaled to w by h if given, cached"""
+        key_ = (filename, w, h)
+        image = Img.cache.get(key_)
+        if image is None:
+            image = ASSETS.image(filename)
             if w > 0 or h > 0:
-                self.image = transform.scale(self.image, (w, h))
-            Img.cache[key_] = self.image
+                image = transform.scale(image, (w, h))
+            Img.cache.put(key_, image)
+        return image
+
+    def update_image(self, filename, x=0, y=0, w=0, h=0):
+        self.image = Img.surface(filename, w, h)
         self.rect = self.image.get_rect(topleft=(x, y))
         self.dirty = 1
 
 
-class Ship(Img):
-    def __init__(self, *groups):
-        super(Ship, self).__init__('ship', 375, 540, 0, 0, *groups)
-        self.timer = time.get_ticks()
+class Mover(object):
+    """Mixin of the sprites that take a step every MOVE_TICKS ticks. moved
+    is the tick of the last step and previous the topleft before it."""
+
+    def start_moving(self, clock):
+        self.clock = clock
+        self.moved = clock.tick
+        self.previous = self.rect.topleft
+
+    def step_due(self):
+        """Whether to take a step this tick, noting it if so"""
+        if self.clock.tick - self.moved < MOVE_TICKS:
+            return False
+        self.moved = self.clock.tick
+        self.previous = self.rect.topleft
+        return True
+
+    def lag(self, now):
+        """The offset from rect to the sprite's place at tick now, which
+        may be fractional, on the way from previous to rect"""
+        left = 1.0 - (now - self.moved) / float(MOVE_TICKS)
+        if left <= 0.0:
+            return 0, 0
+        return (int(round((self.previous[0] - self.rect.x) * left)),
+                int(round((self.previous[1] - self.rect.y) * left)))
+
+
+class Ship(Mover, Img):
+    def __init__(self, scene, *groups):
+        config = scene.config
+        super(Ship, self).__init__('ship', (config.width - 50) // 2,
+                                   config.shipY, 0, 0, scene, *groups)
+        self.maxX = config.width - 60
+        self.start_moving(scene.clock)
 
     def update(self, current_time, keys, *args):
-        if current_time - self.timer > 20:
-            self.timer = current_time
+        if self.step_due():
             if keys[K_LEFT] and self.rect.x > 10:
                 self.rect.x -= 5
                 self.dirty = 1
-            if keys[K_RIGHT] and self.rect.x < 740:
+            if keys[K_RIGHT] and self.rect.x < self.maxX:
                 self.rect.x += 5
                 self.dirty = 1
 
 
-class Bullet(Img):
-    def __init__(self, x, y, velocity, filename, *groups):
-        super(Bullet, self).__init__(filename, x, y, 0, 0, *groups)
+class Bullet(Pooled, Mover, Img):
+    def __init__(self, scene, x, y, velocity, filename, *groups):
+        super(Bullet, self).__init__(filename, x, y)
+        self.reset(scene, x, y, velocity, filename, *groups)
+
+    def reset(self, scene, x, y, velocity, filename, *groups):
+        self.update_image(filename, x, y)
+        self.filename = filename
         self.velocity = velocity
-        self.timer = time.get_ticks()
+        self.maxY = scene.config.height
+        self.start_moving(scene.clock)
+        self.add(scene, *groups)
 
     def update(self, current_time, *args):
-        if current_time - self.timer > 20:
-            self.timer = current_time
+        if self.step_due():
             self.rect.y += self.velocity
             self.dirty = 1
-        if self.rect.y < 15 or self.rect.y > 600:
+        if self.rect.y < 15 or self.rect.y > self.maxY:
             self.kill()
 
+    def snapshot(self):
+        return ('Bullet', self.rect.x, self.rect.y, self.velocity,
+                self.filename, self.moved)
+
+    @classmethod
+    def restore(cls, scene, state):
+        _, x, y, velocity, filename, moved = state
+        group = scene.enemyBullets if velocity > 0 else scene.bullets
+        bullet = cls.spawn(scene, x, y, velocity, filename, group)
+        bullet.moved = moved
+        return bullet
+
 
-class Enemy(Img):
+class Enemy(Sprite):
+    """One cell of an EnemiesGroup, which draws and moves them all. Its
+    kind, 0 to 4, picks the image and score of row kind in the original
+    formation."""
     row_scores = {0: 30, 1: 20, 2: 20, 3: 10, 4: 10}
     row_images = {0: ['enemy1_2', 'enemy1_1'],
                   1: ['enemy2_2', 'enemy2_1'],
@@ -154,37 +633,129 @@ class Enemy(Img):
                   3: ['enemy3_1', 'enemy3_2'],
                   4: ['enemy3_1', 'enemy3_2']}
 
-    def __init__(self, x, y, row, column, *groups):
+    def __init__(self, formation, row, column, kind, *groups):
+        self.formation = formation
         self.row = row
         self.column = column
-        self.imagesCycle = cycle(Enemy.row_images[self.row])
-        super(Enemy, self).__init__(next(self.imagesCycle),
-                                    x, y, 40, 35, *groups)
-        self.score = Enemy.row_scores[self.row]
+        self.kind = kind
+        self.score = Enemy.row_scores[kind]
+        super(Enemy, self).__init__(*groups)
+
+    @property
+    def rect(self):
+        return Rect(self.formation.x + self.column * 50,
+                    self.formation.y + self.row * 45, 40, 35)
+
+
+class Swarm(DirtySprite):
+    """The enemies of an EnemiesGroup drawn as one sprite, from two frames
+    with every enemy in place. Killed enemies are erased from both, and only
+    the cells that still have enemies are shown.
+
+    Once drawn it is never dirty, EnemiesGroup repaints the rows it moves.
+    """
+    composites = {}
+
+    def __init__(self, columns, kinds, *groups):
+        super(Swarm, self).__init__(*groups)
+        self.key = (columns, tuple(kinds))
+        self.frames = [frame.copy() for frame in self._pristine()]
+        self.frame = 0
+        self.bounds = self.frames[0].get_rect()
+        self.image = self.frames[0]
+        self.rect = self.bounds.copy()
+
+    def _pristine(self):
+        if self.key not in Swarm.composites:
+            Swarm.composites.clear()  # Only the current formation
+            Swarm.composites[self.key] = self._composite(*self.key)
+        return Swarm.composites[self.key]
 
-    def toggle_image(self):
-        self.update_image(next(self.imagesCycle),
-                          self.rect.x, self.rect.y, 40, 35)
+    @staticmethod
+    def _composite(columns, kinds):
+        """Both frames for rows of the given kinds, each row blitted whole
+        from one strip of its kind"""
+        frames = []
+        for frame in range(2):
+            img = Surface((columns * 50 - 10, len(kinds) * 45 - 10), SRCALPHA)
+            strips = {}
+            for row, kind in enumerate(kinds):
+                if kind not in strips:
+                    enemy = Img.surface(Enemy.row_images[kind][frame], 40, 35)
+                    strip = Surface((columns * 50 - 10, 35), SRCALPHA)
+                    for col in range(columns):
+                        # Copy the pixels, enemy cells do not overlap
+                        strip.blit(enemy, (col * 50, 0),
+                                   special_flags=BLEND_RGBA_MAX)
+                    strips[kind] = strip
+                img.blit(strips[kind], (0, row * 45),
+                         special_flags=BLEND_RGBA_MAX)
+            frames.append(img)
+        return frames
+
+    def erase(self, row, column):
+        """Erase an enemy, returning the screen area to repaint"""
+        cell = Rect(column * 50, row * 45, 40, 35)
+        for frame in self.frames:
+            frame.fill((0, 0, 0, 0), cell)
+        return cell.move(self.rect.x - self.bounds.x,
+                         self.rect.y - self.bounds.y)
+
+    def redraw(self, row, column):
+        """Draw an erased enemy back"""
+        cell = Rect(column * 50, row * 45, 40, 35)
+        for frame, pristine in zip(self.frames, self._pristine()):
+            frame.blit(pristine, cell, cell, BLEND_RGBA_MAX)
+
+    def place(self, x, y, frame):
+        """Show frame with the formation's top left at (x, y)"""
+        self.frame = frame
+        self.image = self.frames[frame].subsurface(self.bounds)
+        self.rect = self.bounds.move(x, y)
+
+    def crop(self, bounds):
+        """Show only bounds of the frames, there is nothing outside them"""
+        self.rect = bounds.move(self.rect.x - self.bounds.x,
+                                self.rect.y - self.bounds.y)
+        self.bounds = bounds
+        self.image = self.frames[self.frame].subsurface(bounds)
 
 
 class EnemiesGroup(Group):
-    def __init__(self, columns, rows, position):
+    def __init__(self, scene, columns, rows, x, y):
         super(EnemiesGroup, self).__init__()
-        self.enemies = [[None] * columns for _ in range(rows)]
+        self.scene = scene
         self.columns = columns
         self.rows = rows
+        self.config = scene.config
         self.leftAddMove = 0
         self.rightAddMove = 0
-        self.moveTime = 600
+        self.moveTime = self.config.moveTime
         self.direction = 1
-        self.rightMoves = 30
-        self.leftMoves = 30
-        self.moveNumber = 15
-        self.timer = time.get_ticks()
-        self.bottom = position + (rows - 1) * 45 + 35
-        self._aliveColumns = list(range(columns))
+        self.rightMoves = self.config.enemyMoves
+        self.leftMoves = self.config.enemyMoves
+        self.moveNumber = self.config.enemyMoves // 2
+        self.timer = scene.clock.get_ticks()
+        self.x = x  # Top left of the formation
+        self.y = y
+        self.bottom = y + (rows - 1) * 45 + 35
+        # Bit row of _columnBits[column] and bit column of _rowBits[row]
+        # are set while that enemy lives
+        self._columnBits = [(1 << rows) - 1] * columns
+        self._rowBits = [(1 << columns) - 1] * rows
+        self._aliveColumns = list(range(columns))  # Sorted
+        self._lowest = [rows - 1] * columns  # Lowest live row, -1 if none
         self._leftAliveColumn = 0
         self._rightAliveColumn = columns - 1
+        self._topAliveRow = 0
+        self._bottomAliveRow = rows - 1
+        # The original rows' kinds, stretched over all the rows
+        kinds = [row * 5 // rows for row in range(rows)]
+        self.cells = [[Enemy(self, row, col, kinds[row], self)
+                       for col in range(columns)] for row in range(rows)]
+        self.enemies = [list(row) for row in self.cells]  # None once killed
+        self.swarm = Swarm(columns, kinds)
+        self.swarm.place(x, y, 0)
 
     def update(self, current_time):
         if current_time - self.timer > self.moveTime:
@@ -194,29 +765,43 @@ class EnemiesGroup(Group):
                 max_move = self.leftMoves + self.leftAddMove
 
             if self.moveNumber >= max_move:
-                self.leftMoves = 30 + self.rightAddMove
-                self.rightMoves = 30 + self.leftAddMove
+                self.leftMoves = self.config.enemyMoves + self.rightAddMove
+                self.rightMoves = self.config.enemyMoves + self.leftAddMove
                 self.direction *= -1
                 self.moveNumber = 0
-                self.bottom = 0
-                for enemy in self:
-                    enemy.rect.y += ENEMY_MOVE_DOWN
-                    enemy.toggle_image()
-                    if self.bottom < enemy.rect.y:
-                        self.bottom = enemy.rect.y + 35
+                self.y += ENEMY_MOVE_DOWN
+                if self:
+                    self.bottom = self.y + self._bottomAliveRow * 45 + 35
+                else:
+                    self.bottom = 0
             else:
-                velocity = 10 if self.direction == 1 else -10
-                for enemy in self:
-                    enemy.rect.x += velocity
-                    enemy.toggle_image()
+                self.x += 10 if self.direction == 1 else -10
                 self.moveNumber += 1
+            old = self.swarm.rect
+            self.swarm.place(self.x, self.y, 1 - self.swarm.frame)
+            self._repaint_rows(self.swarm.rect.x - old.x,
+                               self.swarm.rect.y - old.y)
             self.timer += self.moveTime
-            event.post(Event(EVENT_ENEMY_MOVE_NOTE, {}))
-
-    def add_internal(self, *sprites):
-        super(EnemiesGroup, self).add_internal(*sprites)
-        for s in sprites:
-            self.enemies[s.row][s.column] = s
+            self.scene.events.publish(EVENT_ENEMY_MOVE_NOTE)
+
+    def collide(self, rect):
+        """Enemies overlapping rect, in group order, looked up in the
+        formation cells it covers"""
+        first_col = max(0, (rect.left - self.x) // 50)
+        last_col = min(self.columns - 1, (rect.right - 1 - self.x) // 50)
+        first_row = max(0, (rect.top - self.y) // 45)
+        last_row = min(self.rows - 1, (rect.bottom - 1 - self.y) // 45)
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                enemy = self.enemies[row][col]
+                if enemy is None:
+                    continue
+                # enemy.rect, without making one
+                x = self.x + col * 50
+                y = self.y + row * 45
+                if (x < rect.right and rect.left < x + 40
+                        and y < rect.bottom and rect.top < y + 35):
+                    yield enemy
 
     def remove_internal(self, *sprites):
         super(EnemiesGroup, self).remove_internal(*sprites)
@@ -225,27 +810,52 @@ class EnemiesGroup(Group):
         self._update_speed()
 
     def is_column_dead(self, column):
-        return not any(self.enemies[row][column]
-                       for row in range(self.rows))
+        return not self._columnBits[column]
+
+    def shooter(self, column):
+        """The lowest enemy of a live column, the one that can fire"""
+        return self.enemies[self._lowest[column]][column]
 
     def random_bottom(self):
-        col = choice(self._aliveColumns)
-        col_enemies = (self.enemies[row - 1][col]
-                       for row in range(self.rows, 0, -1))
-        return next((en for en in col_enemies if en is not None), None)
+        return self.shooter(self.scene.random.choice(self._aliveColumns))
+
+    def random_bottoms(self, count):
+        """Lowest enemies of up to count random columns"""
+        if count == 1:
+            return [self.random_bottom()]
+        count = min(count, len(self._aliveColumns))
+        return [self.shooter(column) for column in
+                self.scene.random.sample(self._aliveColumns, count)]
+
+    def nearest_bottom(self, x):
+        """Lowest enemy of the live column whose centre is nearest x, the
+        left one on ties"""
+        alive = self._aliveColumns
+        column = (x - self.x - 20) / 50.0  # Fractional column centred on x
+        i = bisect_left(alive, column)
+        if i == len(alive) or (i and column - alive[i - 1]
+                               <= alive[i] - column):
+            i -= 1
+        return self.shooter(alive[i])
 
     def _update_speed(self):
-        if len(self) == 1:
-            self.moveTime = 200
-        elif len(self) <= 10:
-            self.moveTime = 400
+        for count, move_time in self.config.speedCurve:
+            if len(self) <= count:
+                self.moveTime = move_time
+                break
 
     def _kill(self, enemy):
         self.changed = True
         self.enemies[enemy.row][enemy.column] = None
+        self._columnBits[enemy.column] &= ~(1 << enemy.row)
+        self._rowBits[enemy.row] &= ~(1 << enemy.column)
+        self._lowest[enemy.column] = \
+            self._columnBits[enemy.column].bit_length() - 1
+        self.scene.repaint_rect(self.swarm.erase(enemy.row, enemy.column))
         is_column_dead = self.is_column_dead(enemy.column)
         if is_column_dead:
-            self._aliveColumns.remove(enemy.column)
+            del self._aliveColumns[bisect_left(self._aliveColumns,
+                                               enemy.column)]
 
         if enemy.column == self._rightAliveColumn:
             while self._rightAliveColumn > 0 and is_column_dead:
@@ -259,49 +869,225 @@ class EnemiesGroup(Group):
                 self.leftAddMove += 5
                 is_column_dead = self.is_column_dead(self._leftAliveColumn)
 
-
-class Blocker(DirtySprite):
-    def __init__(self, x, y, size, color_, *groups):
-        super(Blocker, self).__init__(*groups)
-        self.image = Surface((size, size))
+        while (self._topAliveRow < self._bottomAliveRow
+               and not self._rowBits[self._topAliveRow]):
+            self._topAliveRow += 1
+        while (self._bottomAliveRow > self._topAliveRow
+               and not self._rowBits[self._bottomAliveRow]):
+            self._bottomAliveRow -= 1
+        self._crop()
+
+    def snapshot(self):
+        return (self.x, self.y, self.bottom, self.timer, self.moveTime,
+                self.direction, self.moveNumber, self.leftMoves,
+                self.rightMoves, self.leftAddMove, self.rightAddMove,
+                tuple(self._columnBits), tuple(self._rowBits),
+                tuple(self._aliveColumns), self._leftAliveColumn,
+                self._rightAliveColumn, self._topAliveRow,
+                self._bottomAliveRow, self.swarm.frame)
+
+    def restore(self, state):
+        """Take back a snapshot of this formation, killing and reviving
+        enemies in place"""
+        (self.x, self.y, self.bottom, self.timer, self.moveTime,
+         self.direction, self.moveNumber, self.leftMoves, self.rightMoves,
+         self.leftAddMove, self.rightAddMove, column_bits, row_bits,
+         alive_columns, self._leftAliveColumn, self._rightAliveColumn,
+         self._topAliveRow, self._bottomAliveRow, frame) = state
+        for row, bits in enumerate(row_bits):
+            changed = bits ^ self._rowBits[row]
+            while changed:
+                column = (changed & -changed).bit_length() - 1
+                changed &= changed - 1
+                enemy = self.cells[row][column]
+                if bits >> column & 1:
+                    self.enemies[row][column] = enemy
+                    Group.add_internal(self, enemy)
+                    enemy.add_internal(self)
+                    self.swarm.redraw(row, column)
+                else:
+                    self.enemies[row][column] = None
+                    Group.remove_internal(self, enemy)
+                    enemy.remove_internal(self)
+                    self.swarm.erase(row, column)
+        self._columnBits = list(column_bits)
+        self._rowBits = list(row_bits)
+        self._aliveColumns = list(alive_columns)
+        self._lowest = [bits.bit_length() - 1 for bits in column_bits]
+        self.swarm.place(self.x, self.y, frame)
+        self._crop()
+
+    def _repaint_rows(self, dx, dy):
+        """Repaint where each run of enemies in a row was and is, not the
+        gaps around them"""
+        for row in range(self._topAliveRow, self._bottomAliveRow + 1):
+            bits = self._rowBits[row]
+            while bits:
+                first = (bits & -bits).bit_length() - 1
+                run = bits >> first
+                length = ((run + 1) & ~run).bit_length() - 1
+                bits &= ~(((1 << length) - 1) << first)
+                strip = Rect(self.x + first * 50, self.y + row * 45,
+                             length * 50 - 10, 35)
+                self.scene.repaint_rect(strip.union(strip.move(-dx, -dy)))
+
+    def _crop(self):
+        """Draw only the rows and columns that still have enemies"""
+        left = min(self._leftAliveColumn, self.columns - 1)
+        right = max(self._rightAliveColumn, left)
+        bounds = Rect(left * 50, self._topAliveRow * 45,
+                      (right - left) * 50 + 40,
+                      (self._bottomAliveRow - self._topAliveRow) * 45 + 35)
+        self.swarm.crop(bounds)
+
+
+class Bunker(DirtySprite):
+    """A blocker as a grid of cells drawn from one surface.
+
+    bits holds one int per column with bit n set while the cell in row n
+    is intact, so the lowest or highest intact cell of a column is a single
+    bit operation and destroyed cells are cleared on the cached image.
+    """
+
+    def __init__(self, x, y, columns, rows, cell, color_, *groups):
+        super(Bunker, self).__init__()
+        self.columns = columns
+        self.rows = rows
+        self.cell = cell
+        self.bits = [(1 << rows) - 1] * columns
+        self.color = color_
+        self.image = Surface((columns * cell, rows * cell), SRCALPHA)
         self.image.fill(color_)
         self.rect = self.image.get_rect(topleft=(x, y))
+        self.add(*groups)
+
+    def _span(self, rect):
+        # Columns and row bitmask of the cells overlapping rect
+        cell = self.cell
+        left = max(0, (rect.left - self.rect.x) // cell)
+        right = min(self.columns - 1, (rect.right - 1 - self.rect.x) // cell)
+        top = max(0, (rect.top - self.rect.y) // cell)
+        bottom = min(self.rows - 1, (rect.bottom - 1 - self.rect.y) // cell)
+        if left > right or top > bottom:
+            return range(0), 0
+        return range(left, right + 1), (1 << bottom + 1) - (1 << top)
+
+    def lowest(self, rect):
+        """(column, row) of the lowest intact cell under rect, leftmost
+        on ties, or None"""
+        best = None
+        columns, mask = self._span(rect)
+        for column in columns:
+            hit = self.bits[column] & mask
+            if hit and (best is None or hit.bit_length() - 1 > best[1]):
+                best = column, hit.bit_length() - 1
+        return best
+
+    def highest(self, rect):
+        """(column, row) of the highest intact cell under rect, leftmost
+        on ties, or None"""
+        best = None
+        columns, mask = self._span(rect)
+        for column in columns:
+            hit = self.bits[column] & mask
+            row = (hit & -hit).bit_length() - 1
+            if hit and (best is None or row < best[1]):
+                best = column, row
+        return best
+
+    def destroy(self, column, row):
+        self.bits[column] &= ~(1 << row)
+        self.image.fill((0, 0, 0, 0), (column * self.cell, row * self.cell,
+                                       self.cell, self.cell))
+        self.dirty = 1
 
+    def crush(self, rect):
+        """Destroy every cell overlapping rect"""
+        columns, mask = self._span(rect)
+        for column in columns:
+            for row in range(self.rows):
+                if self.bits[column] & mask & (1 << row):
+                    self.destroy(column, row)
+
+    def restore(self, bits):
+        """Take back the intact cells of a snapshot, bits"""
+        for column, (old, new) in enumerate(zip(self.bits, bits)):
+            if old == new:
+                continue
+            for row in range(self.rows):
+                if (old ^ new) >> row & 1:
+                    color_ = self.color if new >> row & 1 else (0, 0, 0, 0)
+                    self.image.fill(color_, (column * self.cell,
+                                             row * self.cell,
+                                             self.cell, self.cell))
+        self.bits = list(bits)
+        self.dirty = 1
 
-class Mystery(Img):
-    velocity = 2
-
-    def __init__(self, *groups):
-        x = -80 if Mystery.velocity > 0 else 800
-        super(Mystery, self).__init__('mystery', x, 45, 75, 35, *groups)
-        self.mysteryEntered = Sound(SOUND_PATH + 'mysteryentered.wav')
-        self.mysteryEntered.set_volume(0.3)
+    def intact(self):
+        """Top left corners of the remaining cells"""
+        for column, bits in enumerate(self.bits):
+            for row in range(self.rows):
+                if bits & (1 << row):
+                    yield (self.rect.x + column * self.cell,
+                           self.rect.y + row * self.cell)
+
+
+class Mystery(Mover, Img):
+    def __init__(self, scene, *groups):
+        x = -80 if scene.mysteryVelocity > 0 else scene.config.width
+        super(Mystery, self).__init__('mystery', x, 45, 75, 35,
+                                      scene, *groups)
+        self.scene = scene
+        self.mysteryEntered = scene.load_sound('mysteryentered', 0.3)
         self.mysteryEntered.play(fade_ms=1000)
-        self.score = choice([50, 100, 150, 300])
-        self.timer = time.get_ticks()
+        self.score = scene.random.choice([50, 100, 150, 300])
+        self.start_moving(scene.clock)
 
     def update(self, current_time, *args):
-        if current_time - self.timer > 20:
-            self.timer = current_time
-            self.rect.x += Mystery.velocity
+        if self.step_due():
+            self.rect.x += self.scene.mysteryVelocity
             self.dirty = 1
-            if self.rect.x < -80 or self.rect.x > 800:
-                Mystery.velocity *= -1
+            if self.rect.x < -80 or self.rect.x > self.scene.config.width:
+                self.scene.mysteryVelocity *= -1
                 self.kill()
 
     def kill(self):
         super(Mystery, self).kill()
-        time.set_timer(EVENT_MYSTERY, 25000)
-
-
-class EnemyExplosion(Img):
+        self.scene.clock.set_timer(EVENT_MYSTERY,
+                                   self.scene.config.mysteryTime)
+
+    def snapshot(self):
+        return 'Mystery', self.rect.x, self.score, self.moved
+
+    @classmethod
+    def restore(cls, scene, state):
+        # Without __init__, which would play its sound and draw a score
+        _, x, score, moved = state
+        mystery = cls.__new__(cls)
+        Img.__init__(mystery, 'mystery', x, 45, 75, 35, scene,
+                     scene.mysteries)
+        mystery.scene = scene
+        mystery.mysteryEntered = scene.load_sound('mysteryentered', 0.3)
+        mystery.score = score
+        mystery.start_moving(scene.clock)
+        mystery.moved = moved
+        return mystery
+
+
+class EnemyExplosion(Pooled, Img):
     row_colors = ['purple', 'blue', 'blue', 'green', 'green']
 
-    def __init__(self, enemy, *groups):
-        self._filename = 'explosion' + self.row_colors[enemy.row]
-        super(EnemyExplosion, self).__init__(
-            self._filename, enemy.rect.x, enemy.rect.y, 40, 35, *groups)
-        self.timer = time.get_ticks()
+    def __init__(self, scene, enemy, *groups):
+        super(EnemyExplosion, self).__init__('explosionblue')
+        self.reset(scene, enemy, *groups)
+
+    def reset(self, scene, enemy, *groups):
+        self.kind = enemy.kind
+        self._filename = 'explosion' + self.row_colors[enemy.kind]
+        rect = enemy.rect
+        self.update_image(self._filename, rect.x, rect.y, 40, 35)
+        self.timer = scene.clock.get_ticks()
+        self.add(scene, *groups)
 
     def update(self, current_time, *args):
         passed = current_time - self.timer
@@ -312,14 +1098,39 @@ class EnemyExplosion(Img):
         elif 200 < passed:
             self.kill()
 
-
-class MysteryExplosion(Txt):
-    def __init__(self, mystery, *groups):
+    def snapshot(self):
+        grown = self._filename is None
+        return ('EnemyExplosion', self.kind, self.rect.x + 6 * grown,
+                self.rect.y + 6 * grown, grown, self.timer)
+
+    @classmethod
+    def restore(cls, scene, state):
+        _, kind, x, y, grown, timer = state
+        explosion = cls.spawn(scene, Source(Rect(x, y, 40, 35), kind, 0),
+                              scene.explosions)
+        if grown:
+            explosion.update_image(explosion._filename, x - 6, y - 6, 50, 45)
+            explosion._filename = None
+        explosion.timer = timer
+        return explosion
+
+
+class MysteryExplosion(Pooled, Txt):
+    def __init__(self, scene, mystery, *groups):
         super(MysteryExplosion, self).__init__(
             FONT, 20, mystery.score, WHITE,
-            mystery.rect.x + 20, mystery.rect.y + 6,
-            *groups)
-        self.timer = time.get_ticks()
+            mystery.rect.x + 20, mystery.rect.y + 6)
+        self.reset(scene, mystery, *groups)
+
+    def reset(self, scene, mystery, *groups):
+        self._x = mystery.rect.x + 20
+        self._y = mystery.rect.y + 6
+        self._msg = mystery.score
+        self.image, self.rect = self._update_image()
+        self.visible = True
+        self.dirty = 1
+        self.timer = scene.clock.get_ticks()
+        self.add(scene, *groups)
 
     def update(self, current_time, *args):
         super(MysteryExplosion, self).update(current_time, *args)
@@ -332,67 +1143,571 @@ class MysteryExplosion(Txt):
         elif self.visible:
             self.visible = False  # dirty = 1
 
+    def snapshot(self):
+        return ('MysteryExplosion', self._x - 20, self._y - 6, self._msg,
+                self.visible, self.timer)
+
+    @classmethod
+    def restore(cls, scene, state):
+        _, x, y, score, visible, timer = state
+        explosion = cls.spawn(scene, Source(Rect(x, y, 75, 35), 0, score),
+                              scene.explosions)
+        explosion.visible = visible
+        explosion.timer = timer
+        return explosion
+
 
-class ShipExplosion(Img):
-    def __init__(self, ship, *groups):
-        super(ShipExplosion, self).__init__(
-            'ship', ship.rect.x, ship.rect.y, 0, 0, *groups)
-        self.timer = time.get_ticks()
+class ShipExplosion(Pooled, Img):
+    def __init__(self, scene, ship, *groups):
+        super(ShipExplosion, self).__init__('ship')
+        self.reset(scene, ship, *groups)
+
+    def reset(self, scene, ship, *groups):
+        self.update_image('ship', ship.rect.x, ship.rect.y)
+        self.visible = True
+        self.scene = scene
+        self.timer = scene.clock.get_ticks()
+        self.add(scene, *groups)
 
     def update(self, current_time, *args):
         passed = current_time - self.timer
         if 900 < passed:
             self.kill()
-            event.post(Event(EVENT_SHIP_CREATE, {}))
+            self.scene.events.publish(EVENT_SHIP_CREATE)
         elif 300 < passed <= 600 and not self.visible:
             self.visible = True
         elif (passed < 300 or 600 < passed) and self.visible:
             self.visible = False
 
+    def snapshot(self):
+        return ('ShipExplosion', self.rect.x, self.rect.y, self.visible,
+                self.timer)
+
+    @classmethod
+    def restore(cls, scene, state):
+        _, x, y, visible, timer = state
+        explosion = cls.spawn(scene, Source(Rect(x, y, 50, 48), 0, 0),
+                              scene.explosions)
+        explosion.visible = visible
+        explosion.timer = timer
+        return explosion
+
+
+# Shots and explosions come and go all game long
+POOLED = (Bullet, EnemyExplosion, MysteryExplosion, ShipExplosion)
+for cls_ in POOLED:
+    cls_.pool = Pool(cls_)
+# What restore() snapshots of sprites that come and go, by their first item
+RESTORABLE = {cls_.__name__: cls_ for cls_ in POOLED + (Mystery,)}
+
+
+class NullSound(object):
+    def play(self, *args, **kwargs):
+        pass
+
+    def stop(self):
+        pass
+
+    def fadeout(self, millis):
+        pass
+
+    def set_volume(self, value):
+        pass
+
+
+class NullAudio(object):
+    """Audio sink of headless and muted games"""
+
+    def sound(self, name, volume):
+        return NullSound()
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {'played': 0, 'stolen': 0, 'pending': 0}
+
+
+class QueuedSound(object):
+    """Handle the game plays and stops a sound through, which only posts a
+    command to its AudioThread"""
+    __slots__ = ('audio', 'name')
+
+    def __init__(self, audio, name):
+        self.audio = audio
+        self.name = name
+
+    def play(self, fade_ms=0):
+        self.audio.commands.put(('play', self.name, fade_ms))
+
+    def stop(self):
+        self.audio.commands.put(('stop', self.name, 0))
+
+
+class AudioThread(Thread):
+    """Plays sounds from a thread of its own, on VOICES mixer channels.
+
+    Sounds are decoded when first asked for, before the game starts.
+    A sound already playing VOICES_PER_SOUND times, or any sound when every
+    channel is busy, takes over the voice that started first.
+    """
+
+    def __init__(self, assets):
+        super(AudioThread, self).__init__(name='audio')
+        self.daemon = True  # sys.exit() on QUIT does not wait for it
+        self.assets = assets
+        self.commands = SimpleQueue()
+        self.sounds = {}
+        mixer.set_num_channels(VOICES)
+        self.channels = [Channel(i) for i in range(VOICES)]
+        self.voices = [(0, None)] * VOICES  # (start order, name)
+        self.started = 0
+        self.played = self.stolen = 0
+        self.start()
+
+    def sound(self, name, volume):
+        name = str(name)
+        self.sounds[name] = self.assets.sound(name, volume)
+        return QueuedSound(self, name)
+
+    def run(self):
+        while True:
+            command = self.commands.get()
+            if command is None:
+                return
+            action, name, fade_ms = command
+            if action == 'play':
+                self._play(name, fade_ms)
+            else:
+                for i, (_, playing) in enumerate(self.voices):
+                    if playing == name:
+                        self.channels[i].stop()
+                        self.voices[i] = (0, None)
+
+    def _voice(self, name):
+        busy = [self.channels[i].get_busy() for i in range(VOICES)]
+        same = [i for i in range(VOICES)
+                if busy[i] and self.voices[i][1] == name]
+        if len(same) >= VOICES_PER_SOUND:
+            return min(same, key=lambda i: self.voices[i][0]), True
+        if not all(busy):
+            return busy.index(False), False
+        return min(range(VOICES), key=lambda i: self.voices[i][0]), True
+
+    def _play(self, name, fade_ms):
+        i, stolen = self._voice(name)
+        self.started += 1
+        self.voices[i] = (self.started, name)
+        self.channels[i].play(self.sounds[name], fade_ms=fade_ms)
+        self.played += 1
+        self.stolen += stolen
+
+    def close(self):
+        self.commands.put(None)
+        self.join()
+
+    def stats(self):
+        return {'played': self.played, 'stolen': self.stolen,
+                'pending': self.commands.qsize()}
+
+
+class GameEvent(object):
+    """Event of the game itself, without data, so one instance per type is
+    shared by every post"""
+    __slots__ = ('type',)
+    instances = {}
+
+    def __init__(self, type_):
+        self.type = type_
+
+    @classmethod
+    def of(cls, type_):
+        if type_ not in cls.instances:
+            cls.instances[type_] = cls(type_)
+        return cls.instances[type_]
+
+
+class TimerWheel(object):
+    """Timers due at whole ticks, hashed into slots by due tick, so a tick
+    only looks at the timers that may be due then. Each type has at most
+    one timer, scheduling it again replaces it."""
+
+    def __init__(self, slots=TIMER_SLOTS):
+        self.slots = [[] for _ in range(slots)]
+        self._timers = {}  # type: its live [due, period, type, loops]
+
+    def schedule(self, type_, due, period=0, loops=0):
+        """Fire type_ at tick due, then every period ticks if period, until
+        it has fired loops times if loops"""
+        self.cancel(type_)
+        timer = [due, period, type_, loops]
+        self._timers[type_] = timer
+        self.slots[due % len(self.slots)].append(timer)
+
+    def cancel(self, type_):
+        timer = self._timers.pop(type_, None)
+        if timer is not None:
+            self.slots[timer[0] % len(self.slots)].remove(timer)
+
+    def snapshot(self):
+        return tuple(sorted(tuple(timer) for timer in self._timers.values()))
+
+    def restore(self, timers):
+        for type_ in list(self._timers):
+            self.cancel(type_)
+        for due, period, type_, loops in timers:
+            self.schedule(type_, due, period, loops)
+
+    def expire(self, tick):
+        """Types due at tick, in type order, periodic ones rescheduled
+        unless that was their last loop"""
+        slot = self.slots[tick % len(self.slots)]
+        if not slot:
+            return []
+        due = [timer for timer in slot if timer[0] == tick]
+        if not due:
+            return []
+        slot[:] = [timer for timer in slot if timer[0] != tick]
+        fired = []
+        for timer in due:
+            due_, period, type_, loops = timer
+            fired.append(type_)
+            if period and loops != 1:
+                timer[0] += period
+                timer[3] = loops and loops - 1
+                self.slots[timer[0] % len(self.slots)].append(timer)
+            else:
+                del self._timers[type_]
+        fired.sort()
+        return fired
+
+
+class SimClock(object):
+    """Fixed-timestep clock standing in for pygame.time and pygame.event.
+
+    Game time only moves in whole ticks, so the outcome of a game does not
+    depend on frame rate: advance() turns real elapsed time into a number
+    of ticks to simulate and leaves the remainder in alpha for rendering.
+    Events are queued in process and handed out by get() once a tick, the
+    timers' ones in a batch at the end of the tick they are due.
+    """
+
+    def __init__(self, max_ticks=MAX_TICKS_PER_FRAME):
+        self.tick = 0
+        self.max_ticks = max_ticks
+        self.accumulator = 0.0
+        self.alpha = 0.0
+        self.skipped = 0  # Ticks dropped because a frame took too long
+        self.timers = TimerWheel()
+        self._queue = []
+
+    def get_ticks(self):
+        return int(self.tick * TICK_TIME)
+
+    def set_timer(self, type_, millis, loops=0):
+        """pygame.time.set_timer, on ticks: repeat every millis, or only
+        loops times"""
+        if millis > 0:
+            period = max(1, int(round(millis / TICK_TIME)))
+            self.timers.schedule(type_, self.tick + period, period, loops)
+        else:
+            self.timers.cancel(type_)
+
+    def advance(self, millis, catch_up=False):
+        """Ticks to simulate for millis of real time, no more than
+        max_ticks unless catch_up"""
+        self.accumulator += millis
+        ticks = int(self.accumulator // TICK_TIME)
+        self.accumulator -= ticks * TICK_TIME
+        if ticks > self.max_ticks and not catch_up:
+            self.skipped += ticks - self.max_ticks
+            ticks = self.max_ticks
+        self.alpha = self.accumulator / TICK_TIME
+        return ticks
+
+    def step(self):
+        self.tick += 1
+        for type_ in self.timers.expire(self.tick):
+            self._queue.append(GameEvent.of(type_))
+
+    def until(self, millis):
+        """Real ms until advance() reaches a tick that starts at game time
+        millis, 0 if the next tick does"""
+        due = int(ceil(millis / TICK_TIME))
+        if due <= self.tick:
+            return 0
+        return (due - self.tick + 1) * TICK_TIME - self.accumulator
+
+    def skip(self, ticks):
+        """Move on ticks without simulating them, for a scene they would
+        not have changed. The events of their timers are dropped."""
+        for _ in range(ticks):
+            self.step()
+        self._queue = [evt for evt in self._queue
+                       if not isinstance(evt, GameEvent)]
+
+    def post(self, evt):
+        self._queue.append(evt)
+
+    def publish(self, type_):
+        """Post the game event of type_"""
+        self._queue.append(GameEvent.of(type_))
+
+    def get(self):
+        events, self._queue = self._queue, []
+        return events
+
+    def clear(self):
+        self._queue = []
+
+    def snapshot(self):
+        # Game events by type, input ones by type and attributes
+        queue = tuple(evt.type if isinstance(evt, GameEvent)
+                      else (evt.type, evt.dict) for evt in self._queue)
+        return self.tick, self.timers.snapshot(), queue
+
+    def restore(self, state):
+        self.tick, timers, queue = state
+        self.timers.restore(timers)
+        self._queue = [GameEvent.of(evt) if isinstance(evt, int)
+                       else Event(*evt) for evt in queue]
+
+
+class DamageGrid(object):
+    """Damaged screen rects, each overlapping pair merged into one. Rects
+    are bucketed by the tiles they cover, so a new one is only tested
+    against its neighbours. The buckets are kept between frames."""
+
+    def __init__(self, tile=DAMAGE_TILE):
+        self.tile = tile
+        self._rects = []  # None where merged into a later one
+        self._tiles = {}  # ty << 16 | tx: indexes into _rects
+        self._used = []
+
+    def __len__(self):
+        return len(self._rects) - self._rects.count(None)
+
+    def _overlapping(self, rect, tx0, ty0, tx1, ty1):
+        tiles = self._tiles
+        rects = self._rects
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                for i in tiles.get(ty << 16 | tx, ()):
+                    if rects[i] is not None and rect.colliderect(rects[i]):
+                        return i
+        return -1
+
+    def add(self, rect):
+        if not rect.w or not rect.h:
+            return
+        rect = Rect(rect)
+        tile = self.tile
+        while True:
+            tx0, ty0 = rect.left // tile, rect.top // tile
+            tx1, ty1 = (rect.right - 1) // tile, (rect.bottom - 1) // tile
+            i = self._overlapping(rect, tx0, ty0, tx1, ty1)
+            if i < 0:
+                break
+            rect.union_ip(self._rects[i])
+            self._rects[i] = None
+        index = len(self._rects)
+        self._rects.append(rect)
+        tiles = self._tiles
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                bucket = tiles.get(ty << 16 | tx)
+                if bucket is None:
+                    bucket = tiles[ty << 16 | tx] = []
+                if not bucket:
+                    self._used.append(bucket)
+                bucket.append(index)
+
+    def rects(self):
+        return [rect for rect in self._rects if rect is not None]
+
+    def clear(self):
+        del self._rects[:]
+        for bucket in self._used:
+            del bucket[:]
+        del self._used[:]
+
 
 class EmptyScene(LayeredDirty):
+    """LayeredDirty drawn through a DamageGrid, repainting the damage or
+    the whole screen, whichever blits fewer pixels. blitted and blits count
+    the pixels and blit calls of the last draw()."""
+    # What a blit call costs beyond its pixels, in pixels, per kind of
+    # surface drawn to
+    blitCosts = {}
+
     def __init__(self, *sprites, **kwargs):
+        # A SimClock of its own unless one is injected
+        self.clock = kwargs.pop('clock', None) or SimClock()
+        self.events = kwargs.pop('events', self.clock)
+        self.handlers = {}
+        self.subscribe(QUIT, self.quit)
+        self.subscribe(KEYUP, self.quit)
+        self.config = kwargs.pop('config', DEFAULT_CONFIG)
         super(EmptyScene, self).__init__(*sprites, **kwargs)
-        self.set_timing_treshold(1000.0 / 25.0)
-        self.clear(SCREEN, BACKGROUND)
-        self.timer = time.get_ticks()
+        self.clear(None, ASSETS.background(self.config.size))
+        self.damage = DamageGrid()
+        self.blitted = self.blits = 0
+        self.timer = self.clock.get_ticks()
         if DEBUG:
-            self.fps = Txt(FONT, 12, "FPS: ", RED, 0, 587, self)
+            self.fps = Txt(FONT, 12, "FPS: ", RED, 0,
+                           self.config.height - 13, self)
+
+    def subscribe(self, type_, handler):
+        """Have process_event() pass events of type_ to handler, after the
+        handlers subscribed before"""
+        self.handlers.setdefault(type_, []).append(handler)
+
+    def process_event(self, evt):
+        for handler in self.handlers.get(evt.type, ()):
+            handler(evt)
 
     @staticmethod
-    def process_event(evt):
-        if evt.type == QUIT or (evt.type == KEYUP and evt.key == K_ESCAPE):
+    def quit(evt):
+        if evt.type == QUIT or evt.key == K_ESCAPE:
             sys.exit()
 
+    def next_change(self, current_time):
+        """The time update() next changes the scene by itself at, None if
+        only input changes it"""
+        return None
+
+    def enter(self, overlay=False):
+        """Start the scene over. An overlay draws all its sprites again, on
+        top of what the scene before left on screen."""
+        self.timer = self.clock.get_ticks()
+        if overlay:
+            for spr in self.sprites():
+                if not spr.dirty:
+                    spr.dirty = 1
+
+    @classmethod
+    def blit_cost(cls, surface):
+        """What a blit call to surface costs beyond its pixels, in pixels,
+        timed the first time a surface of its size and format is drawn to"""
+        kind = surface.get_size(), surface.get_bitsize(), surface.get_flags()
+        cost = cls.blitCosts.get(kind)
+        if cost is not None:
+            return cost
+        saved, clip = surface.copy(), surface.get_clip()
+        surface.set_clip(None)
+        side = min(256, *surface.get_size())
+        source = Surface((side, side), 0, surface)
+        pixel = Rect(0, 0, 1, 1)
+        blit = surface.blit
+        small = large = float('inf')
+        for _ in range(3):
+            start = default_timer()
+            for i in range(BLIT_SAMPLES):
+                blit(source, (i, 0), pixel)
+            small = min(small, (default_timer() - start) / BLIT_SAMPLES)
+            start = default_timer()
+            for _ in range(4):
+                blit(source, (0, 0))
+            large = min(large, (default_timer() - start) / (4 * side * side))
+        surface.blit(saved, (0, 0))
+        surface.set_clip(clip)
+        cost = cls.blitCosts[kind] = max(0, int(small / large) - 1)
+        return cost
+
+    def draw(self, surface, bgsurf=None, special_flags=None):
+        if bgsurf is not None:
+            self._bgd = bgsurf
+        cost = self.blit_cost(surface)
+        orig_clip = surface.get_clip()
+        clip = orig_clip if self._clip is None else self._clip
+        surface.set_clip(clip)
+        sprites = self._spritelist
+        old_rects = self.spritedict
+
+        damage = self.damage
+        for rect in self.lostsprites:
+            damage.add(rect.clip(clip))
+        for spr in sprites:
+            if spr.dirty > 0:
+                if spr.source_rect is None:
+                    damage.add(spr.rect.clip(clip))
+                else:
+                    damage.add(Rect(spr.rect.topleft,
+                                    spr.source_rect.size).clip(clip))
+                if old_rects[spr] is not self._init_rect:
+                    damage.add(old_rects[spr].clip(clip))
+        update = damage.rects()
+        damage.clear()
+        self.lostsprites[:] = []
+        full = (sum(rect.w * rect.h + cost for rect in update)
+                >= clip.w * clip.h + cost)
+        if full:
+            update = [Rect(clip)]
+
+        blit = surface.blit
+        blitted = blits = 0
+        if self._bgd is not None:
+            flags = 0 if special_flags is None else special_flags
+            for rect in update:
+                blit(self._bgd, rect, rect, flags)
+                blitted += rect.w * rect.h
+            blits += len(update)
+        for spr in sprites:
+            flags = spr.blendmode if special_flags is None else special_flags
+            if spr.visible and (spr.dirty > 0 or full):
+                old_rects[spr] = drawn = blit(spr.image, spr.rect,
+                                              spr.source_rect, flags)
+                blitted += drawn.w * drawn.h
+                blits += 1
+            elif spr.visible:
+                # Only the parts of the sprite that were repainted
+                if spr.source_rect is None:
+                    spr_rect = spr.rect
+                    dx, dy = spr_rect.x, spr_rect.y
+                else:
+                    spr_rect = Rect(spr.rect.topleft, spr.source_rect.size)
+                    dx = spr_rect.x - spr.source_rect.x
+                    dy = spr_rect.y - spr.source_rect.y
+                for i in spr_rect.collidelistall(update):
+                    part = spr_rect.clip(update[i])
+                    blit(spr.image, part,
+                         (part.x - dx, part.y - dy, part.w, part.h), flags)
+                    blitted += part.w * part.h
+                    blits += 1
+            if spr.dirty == 1:
+                spr.dirty = 0
+        self.blitted = blitted
+        self.blits = blits
+        surface.set_clip(orig_clip)
+        return update
+
 
 class MainScene(EmptyScene):
     def __init__(self, on_key_up, *sprites, **kwargs):
         super(MainScene, self).__init__(*sprites, **kwargs)
         self.on_key_up = on_key_up
+        self.subscribe(KEYUP, lambda evt: self.on_key_up())
+        at = self.config.center
         self.add(
-            Txt(FONT, 50, 'Space Invaders', WHITE, 164, 155),
-            Txt(FONT, 25, 'Press any key to continue', WHITE, 201, 225),
-            Img('enemy3_1', 318, 270, 40, 40),
-            Txt(FONT, 25, '   =   10 pts', GREEN, 368, 270),
-            Img('enemy2_2', 318, 320, 40, 40),
-            Txt(FONT, 25, '   =  20 pts', BLUE, 368, 320),
-            Img('enemy1_2', 318, 370, 40, 40),
-            Txt(FONT, 25, '   =  30 pts', PURPLE, 368, 370),
-            Img('mystery', 299, 420, 80, 40),
-            Txt(FONT, 25, '   =  ?????', RED, 368, 420),
+            Txt(FONT, 50, 'Space Invaders', WHITE, *at(164, 155)),
+            Txt(FONT, 25, 'Press any key to continue', WHITE, *at(201, 225)),
+            Img('enemy3_1', *at(318, 270) + (40, 40)),
+            Txt(FONT, 25, '   =   10 pts', GREEN, *at(368, 270)),
+            Img('enemy2_2', *at(318, 320) + (40, 40)),
+            Txt(FONT, 25, '   =  20 pts', BLUE, *at(368, 320)),
+            Img('enemy1_2', *at(318, 370) + (40, 40)),
+            Txt(FONT, 25, '   =  30 pts', PURPLE, *at(368, 370)),
+            Img('mystery', *at(299, 420) + (80, 40)),
+            Txt(FONT, 25, '   =  ?????', RED, *at(368, 420)),
         )
 
-    def process_event(self, evt):
-        super(MainScene, self).process_event(evt)
-        if evt.type == KEYUP:
-            self.on_key_up()
-
 
 class NextRoundScene(EmptyScene):
     def __init__(self, on_finish, *sprites, **kwargs):
         super(NextRoundScene, self).__init__(*sprites, **kwargs)
         self.on_finish = on_finish
-        self.add(Txt(FONT, 50, 'Next Round', WHITE, 240, 270))
+        self.add(Txt(FONT, 50, 'Next Round', WHITE,
+                     *self.config.center(240, 270)))
 
     def update(self, current_time, *args):
         super(NextRoundScene, self).update(current_time, *args)
@@ -400,12 +1715,20 @@ class NextRoundScene(EmptyScene):
         if 3000 < passed:
             self.on_finish()
 
+    def next_change(self, current_time):
+        return self.timer + 3001
+
 
 class GameOverScene(EmptyScene):
     def __init__(self, on_finish, *sprites, **kwargs):
         super(GameOverScene, self).__init__(*sprites, **kwargs)
         self.on_finish = on_finish
-        self.gameOverTxt = Txt(FONT, 50, 'Game Over', WHITE, 250, 270, self)
+        self.gameOverTxt = Txt(FONT, 50, 'Game Over', WHITE,
+                               *self.config.center(250, 270) + (self,))
+
+    def enter(self, overlay=False):
+        self.gameOverTxt.visible = True
+        super(GameOverScene, self).enter(overlay)
 
     def update(self, current_time, *args):
         super(GameOverScene, self).update(current_time, *args)
@@ -418,27 +1741,40 @@ class GameOverScene(EmptyScene):
         elif self.gameOverTxt.visible:
             self.gameOverTxt.visible = False  # dirty = 1
 
+    def next_change(self, current_time):
+        passed = current_time - self.timer
+        return self.timer + next((at for at in (750, 1501, 2250, 3001)
+                                  if passed < at), passed)
+
 
 class GameScene(EmptyScene):
     def __init__(self, on_round, on_over, *sprites, **kwargs):
+        self.random = Random(kwargs.pop('seed', None))
+        self.audio = kwargs.pop('audio', None) or NullAudio()
+        # Draw movers between ticks rather than where the last tick left
+        self.smooth = kwargs.pop('smooth', False)
+        self._encoder = None
         super(GameScene, self).__init__(*sprites, **kwargs)
         self.on_round = on_round
         self.on_over = on_over
+        self.subscribe(KEYDOWN, self.fire)
+        self.subscribe(EVENT_SHIP_CREATE, self.create_ship)
+        self.subscribe(EVENT_ENEMY_SHOOT, self.enemy_shoot)
+        self.subscribe(EVENT_ENEMY_MOVE_NOTE, self.play_note)
+        self.subscribe(EVENT_MYSTERY, self.spawn_mystery)
         # Init sounds
         self.sounds = {}
         for name in ['shoot', 'shoot2', 'invaderkilled', 'mysterykilled',
                      'shipexplosion']:
-            self.sounds[name] = Sound(SOUND_PATH + '{}.wav'.format(name))
-            self.sounds[name].set_volume(0.2)
+            self.sounds[name] = self.load_sound(name, 0.2)
         # Init notes
-        self.musicNotes = [Sound(SOUND_PATH + '{}.wav'.format(i))
-                           for i in range(4)]
-        for note in self.musicNotes:
-            note.set_volume(0.5)
-        self.musicNotesCycle = cycle(self.musicNotes)
+        self.musicNotes = [self.load_sound(i, 0.5) for i in range(4)]
+        self.noteIndex = 0
 
         # Counter for enemy starting position (increased each new round)
         self.enemyPosition = ENEMY_DEFAULT_POSITION
+        self.mysteryVelocity = 2  # x per move, its sign the next direction
+        self.prepared = None  # Formation built ahead by prepare_enemies()
         self.bullets = Group()
         self.enemyBullets = Group()
         self.explosions = Group()
@@ -446,84 +1782,200 @@ class GameScene(EmptyScene):
         self.mysteries = Group()
         self.blockers = Group()
 
+        right = self.config.width
         self.dashGroup = Group(Txt(FONT, 20, 'Score', WHITE, 5, 5),
-                               Txt(FONT, 20, 'Lives ', WHITE, 640, 5))
+                               Txt(FONT, 20, 'Lives ', WHITE, right - 160, 5))
         self.scoreTxt = Txt(FONT, 20, 0, GREEN, 85, 5, self.dashGroup)
-        self.life1 = Img('ship', 715, 3, 23, 23, self.dashGroup)
-        self.life2 = Img('ship', 742, 3, 23, 23, self.dashGroup)
-        self.life3 = Img('ship', 769, 3, 23, 23, self.dashGroup)
+        self.life1 = Img('ship', right - 85, 3, 23, 23, self.dashGroup)
+        self.life2 = Img('ship', right - 58, 3, 23, 23, self.dashGroup)
+        self.life3 = Img('ship', right - 31, 3, 23, 23, self.dashGroup)
+        self.lives = (self.life1, self.life2, self.life3)
+        self.dash = ([self.fps] if DEBUG else []) + self.dashGroup.sprites()
+
+    def load_sound(self, name, volume):
+        return self.audio.sound(name, volume)
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            from observation import ObservationEncoder
+            self._encoder = ObservationEncoder(
+                self.config, 90 // BLOCKER_CELL, 40 // BLOCKER_CELL)
+        return self._encoder
+
+    def observe(self, out=None):
+        """The state as one int32 vector, laid out by self.encoder; needs
+        numpy"""
+        return self.encoder.encode(self, out)
+
+    def observe_frame(self, downsample=4, out=None):
+        """Gray frame downsampled by downsample, drawn without blits"""
+        return self.encoder.sketch(self, downsample, out)
+
+    def _fixed(self):
+        # Sprites that stay for the whole round, by index in snapshots
+        return self.dash + self.blockers.sprites() + [self.enemies.swarm,
+                                                      self.player]
+
+    def snapshot(self):
+        """The whole game state as nested tuples of plain values, which
+        restore() takes back; cheap enough to clone games for search"""
+        index = {id(sprite): i for i, sprite in enumerate(self._fixed())}
+        order = tuple(index[id(sprite)] if id(sprite) in index
+                      else sprite.snapshot() for sprite in self.sprites())
+        player = self.player
+        return (order, self.enemyPosition, self.scoreTxt.msg,
+                tuple(life.alive() for life in self.lives),
+                (player.rect.x, player.rect.y, player.moved, player.alive()),
+                self.enemies.snapshot(),
+                tuple(tuple(bunker.bits) for bunker in self.blockers),
+                self.noteIndex, self.mysteryVelocity, self.random.getstate(),
+                (self.shots, self.hits, self.kills, self.roundStart))
+
+    def restore(self, state):
+        (order, self.enemyPosition, score, lives, player, enemies, bunkers,
+         self.noteIndex, self.mysteryVelocity, random_state,
+         (self.shots, self.hits, self.kills, self.roundStart)) = state
+        for gr in (self, self.players, self.explosions, self.mysteries,
+                   self.bullets, self.enemyBullets):
+            gr.empty()
+        for cls_ in POOLED:
+            cls_.pool.reclaim()
+        self.scoreTxt.msg = score
+        for life, alive in zip(self.lives, lives):
+            if alive:
+                self.dashGroup.add(life)
+            else:
+                self.dashGroup.remove(life)
+        self.player.rect.topleft = self.player.previous = player[:2]
+        self.player.moved = player[2]
+        if player[3]:
+            self.players.add(self.player)
+        self.enemies.restore(enemies)
+        for bunker, bits in zip(self.blockers, bunkers):
+            bunker.restore(bits)
+        self.random.setstate(random_state)
+        fixed = self._fixed()
+        for sprite in order:
+            if isinstance(sprite, int):
+                self.add(fixed[sprite])
+            else:
+                RESTORABLE[sprite[0]].restore(self, sprite)
 
     def make_blockers(self):
-        for offset in (50, 250, 450, 650):
-            for row in range(4):
-                for column in range(9):
-                    x = offset + (column * 10)
-                    y = BLOCKERS_POSITION + (row * 10)
-                    Blocker(x, y, 10, GREEN, self.blockers)
+        for offset in self.config.blockerOffsets:
+            Bunker(offset, self.config.blockersPosition, 90 // BLOCKER_CELL,
+                   40 // BLOCKER_CELL, BLOCKER_CELL, GREEN, self.blockers)
+
+    def prepare_enemies(self, position):
+        """Build the formation of a round starting at position ahead of
+        time, for make_enemies() to take instead of building it then"""
+        config = self.config
+        self.prepared = EnemiesGroup(self, config.columns, config.rows,
+                                     config.enemyX, position)
 
     def make_enemies(self):
-        self.enemies = EnemiesGroup(10, 5, self.enemyPosition)
-        for row in range(5):
-            for col in range(10):
-                x = 154 + (col * 50)
-                y = self.enemyPosition + (row * 45)
-                Enemy(x, y, row, col, self.enemies, self)
+        config = self.config
+        prepared, self.prepared = self.prepared, None
+        if prepared is not None and prepared.y == self.enemyPosition:
+            self.enemies = prepared
+            self.enemies.timer = self.clock.get_ticks()
+        else:
+            self.enemies = EnemiesGroup(self, config.columns, config.rows,
+                                        config.enemyX, self.enemyPosition)
+        self.add(self.enemies.swarm)
 
     def reset(self):
         for gr in (self, self.players, self.explosions, self.mysteries,
                    self.bullets, self.enemyBullets):
             gr.empty()
+        for cls_ in POOLED:
+            cls_.pool.reclaim()
         if DEBUG:
             self.add(self.fps)
         self.add(self.dashGroup, self.blockers)
         self.player = Ship(self, self.players)
         self.make_enemies()
-        event.clear()
-        time.set_timer(EVENT_ENEMY_SHOOT, 700)
-        time.set_timer(EVENT_MYSTERY, 25000)
+        # This round's statistics
+        self.shots = self.hits = self.kills = 0
+        self.roundStart = self.clock.get_ticks()
+        self.events.clear()
+        self.clock.set_timer(EVENT_ENEMY_SHOOT, self.config.enemyFireTime)
+        self.clock.set_timer(EVENT_MYSTERY, self.config.mysteryTime)
+
+    def fire(self, evt):
+        if evt.key != K_SPACE:
+            return
+        if len(self.bullets) < self.config.shipBullets and self.player.alive():
+            x = self.player.rect.x
+            y = self.player.rect.y + 5
+            if self.scoreTxt.msg < self.config.doubleShotScore:
+                Bullet.spawn(self, x + 23, y, -15, 'laser', self.bullets)
+                self.sounds['shoot'].play()
+                self.shots += 1
+            else:
+                Bullet.spawn(self, x + 8, y, -15, 'laser', self.bullets)
+                Bullet.spawn(self, x + 38, y, -15, 'laser', self.bullets)
+                self.sounds['shoot2'].play()
+                self.shots += 2
 
-    def process_event(self, evt):
-        super(GameScene, self).process_event(evt)
-        if evt.type == KEYDOWN and evt.key == K_SPACE:
-            if not self.bullets and self.player.alive():
-                y = self.player.rect.y + 5
-                if self.scoreTxt.msg < 1000:
-                    Bullet(self.player.rect.x + 23, y, -15, 'laser',
-                           self.bullets, self)
-                    self.sounds['shoot'].play()
-                else:
-                    Bullet(self.player.rect.x + 8, y, -15, 'laser',
-                           self.bullets, self)
-                    Bullet(self.player.rect.x + 38, y, -15, 'laser',
-                           self.bullets, self)
-                    self.sounds['shoot2'].play()
-        elif evt.type == EVENT_SHIP_CREATE:
-            self.player = Ship(self, self.players)
-        elif evt.type == EVENT_ENEMY_SHOOT and self.enemies:
-            enemy = self.enemies.random_bottom()
-            Bullet(enemy.rect.x + 14, enemy.rect.y + 20, 5, 'enemylaser',
-                   self.enemyBullets, self)
-        elif evt.type == EVENT_ENEMY_MOVE_NOTE:
-            next(self.musicNotesCycle).play()
-        elif evt.type == EVENT_MYSTERY:
-            Mystery(self.mysteries, self)
+    def create_ship(self, evt):
+        self.player = Ship(self, self.players)
+
+    def enemy_shoot(self, evt):
+        config = self.config
+        count = config.enemyShooters
+        if config.enemyBullets:
+            count = min(count, config.enemyBullets - len(self.enemyBullets))
+        if not self.enemies or count <= 0:
+            return
+        if (config.enemyAim and self.player.alive()
+                and self.random.random() < config.enemyAim):
+            aimed = self.enemies.nearest_bottom(self.player.rect.centerx)
+            others = self.enemies.random_bottoms(count - 1) if count > 1 \
+                else []
+            shooters = [aimed] + [enemy for enemy in others
+                                  if enemy.column != aimed.column]
+        else:
+            shooters = self.enemies.random_bottoms(count)
+        for enemy in shooters:
+            Bullet.spawn(self, enemy.rect.x + 14, enemy.rect.y + 20, 5,
+                         'enemylaser', self.enemyBullets)
+
+    def play_note(self, evt):
+        self.musicNotes[self.noteIndex].play()
+        self.noteIndex = (self.noteIndex + 1) % len(self.musicNotes)
+
+    def spawn_mystery(self, evt):
+        Mystery(self, self.mysteries)
 
     def check_collisions(self):
         groupcollide(self.bullets, self.enemyBullets, True, True)
 
-        for enemy in groupcollide(self.enemies, self.bullets,
-                                  True, True).keys():
+        # Each bullet takes out the first enemy it overlaps
+        killed = {}
+        for bullet in self.bullets.sprites():
+            enemy = next(self.enemies.collide(bullet.rect), None)
+            if enemy is not None:
+                killed[enemy.row, enemy.column] = enemy
+                bullet.kill()
+                self.hits += 1
+        for _, enemy in sorted(killed.items()):
+            enemy.kill()
             self.sounds['invaderkilled'].play()
             self.scoreTxt.msg += enemy.score
-            EnemyExplosion(enemy, self.explosions, self)
+            self.kills += 1
+            EnemyExplosion.spawn(self, enemy, self.explosions)
 
         for mystery in groupcollide(self.mysteries, self.bullets,
                                     True, True).keys():
             mystery.mysteryEntered.stop()
             self.sounds['mysterykilled'].play()
             self.scoreTxt.msg += mystery.score
-            MysteryExplosion(mystery, self.explosions, self)
-            Mystery.velocity = 2  # Reset direction
+            self.hits += 1
+            self.kills += 1
+            MysteryExplosion.spawn(self, mystery, self.explosions)
+            self.mysteryVelocity = 2  # Reset direction
 
         for playerShip in groupcollide(self.players, self.enemyBullets,
                                        True, True).keys():
@@ -536,23 +1988,57 @@ class GameScene(EmptyScene):
             else:
                 self.on_over()
             self.sounds['shipexplosion'].play()
-            ShipExplosion(playerShip, self.explosions, self)
-
-        if self.enemies.bottom >= 540:
-            groupcollide(self.enemies, self.players, True, True)
-            if not self.player.alive() or self.enemies.bottom >= 600:
+            ShipExplosion.spawn(self, playerShip, self.explosions)
+
+        if self.enemies.bottom >= self.config.shipY:
+            if self.player.alive():
+                enemy = next(self.enemies.collide(self.player.rect), None)
+                if enemy is not None:
+                    enemy.kill()
+                    self.player.kill()
+            if (not self.player.alive()
+                    or self.enemies.bottom >= self.config.height):
                 self.on_over()
 
-        for _, blockers in groupcollide(self.bullets, self.blockers,
-                                        True, False).items():
-            max(blockers, key=lambda b: b.rect.bottom).kill()
-
-        for _, blockers in groupcollide(self.enemyBullets, self.blockers,
-                                        True, False).items():
-            min(blockers, key=lambda b: b.rect.top).kill()
-
-        if self.enemies.bottom >= BLOCKERS_POSITION:
-            groupcollide(self.enemies, self.blockers, False, True)
+        # Player bullets erode blockers from below, enemy ones from above
+        bunkers = self.blockers.sprites()
+        rects = [bunker.rect for bunker in bunkers]
+        for bullets, find in ((self.bullets, Bunker.lowest),
+                              (self.enemyBullets, Bunker.highest)):
+            hits = [(bullet, bunkers[i], find(bunkers[i], bullet.rect))
+                    for bullet in bullets
+                    for i in bullet.rect.collidelistall(rects)]
+            for bullet, bunker, cell in hits:
+                if cell:
+                    bullet.kill()
+                    bunker.destroy(*cell)
+
+        if self.enemies.bottom >= self.config.blockersPosition:
+            for bunker in self.blockers:
+                for enemy in self.enemies.collide(bunker.rect):
+                    bunker.crush(enemy.rect)
+
+    def draw(self, surface, bgsurf=None, special_flags=None):
+        if not self.smooth:
+            return super(GameScene, self).draw(surface, bgsurf,
+                                               special_flags)
+        # Draw the movers on their way from their last step, at the time
+        # between the last tick and the next
+        now = self.clock.tick - 1 + self.clock.alpha
+        shifted = []
+        for sprite in (self.players.sprites() + self.bullets.sprites()
+                       + self.enemyBullets.sprites()
+                       + self.mysteries.sprites()):
+            dx, dy = sprite.lag(now)
+            if dx or dy:
+                sprite.rect.move_ip(dx, dy)
+                shifted.append((sprite, dx, dy))
+            if sprite.rect.topleft != self.spritedict[sprite].topleft:
+                sprite.dirty = sprite.dirty or 1
+        dirty = super(GameScene, self).draw(surface, bgsurf, special_flags)
+        for sprite, dx, dy in shifted:
+            sprite.rect.move_ip(-dx, -dy)
+        return dirty
 
     def update(self, current_time, *args):
         super(GameScene, self).update(current_time, *args)
@@ -563,6 +2049,9 @@ class GameScene(EmptyScene):
         else:
             self.on_round()
 
+    def next_change(self, current_time):
+        return current_time  # Played every frame
+
     def new_game(self):
         # Reset enemy start position
         self.enemyPosition = ENEMY_DEFAULT_POSITION
@@ -579,60 +2068,513 @@ class GameScene(EmptyScene):
         self.reset()
 
 
+class SceneManager(object):
+    """Scenes built once and entered again, rather than built anew on
+    every switch. A scene entered repaints only what others drew over it
+    since it last drew; an overlay draws on top of it. defer() queues work
+    for idle() to run in what is left of a frame.
+
+    hitches holds (name, ms) of each frame a scene was switched in.
+    """
+
+    def __init__(self, surface):
+        self.surface = surface
+        self.scenes = {}
+        self.stale = {}  # name: rects others drew, None to repaint all
+        self.name = self.scene = None
+        self.switched = None
+        self.hitches = []
+        self.tasks = deque()
+
+    def add(self, name, scene):
+        self.scenes[name] = scene
+        self.stale[name] = None
+        return scene
+
+    def switch(self, name, overlay=False):
+        scene = self.scenes[name]
+        scene.enter(overlay)
+        stale = self.stale[name]
+        bounds = self.surface.get_rect()
+        if stale is None or (sum(rect.w * rect.h for rect in stale)
+                             >= bounds.w * bounds.h):
+            stale = [bounds]  # Cheaper than many rects in a DamageGrid
+        if not overlay:
+            for rect in stale:
+                scene.repaint_rect(rect)
+        self.stale[name] = []
+        self.name, self.scene = name, scene
+        self.switched = name
+        return scene
+
+    def draw(self):
+        dirty = self.scene.draw(self.surface)
+        if dirty:
+            for name, stale in self.stale.items():
+                if name == self.name or stale is None:
+                    continue
+                stale.extend(dirty)
+                if len(stale) > MAX_STALE:
+                    stale[:] = [stale[0].unionall(stale[1:])]
+        return dirty
+
+    def defer(self, task):
+        self.tasks.append(task)
+
+    def idle(self, deadline):
+        """Run deferred tasks until the default_timer() deadline"""
+        while self.tasks and default_timer() < deadline:
+            self.tasks.popleft()()
+
+    def end_frame(self, start):
+        """The ms of a frame begun at default_timer() start if a scene
+        was switched in during it, else None"""
+        if self.switched is None:
+            return None
+        millis = (default_timer() - start) * 1000.0
+        self.hitches.append((self.switched, millis))
+        self.switched = None
+        return millis
+
+
+class FramePacer(object):
+    """Waits out the rest of each frame of SpaceInvaders.loop.
+
+    While anything moves, frames are due every 1 / fps seconds on a fixed
+    schedule, as a vsync would have them, or right away with fps 0 (e.g.
+    when the display waits for the vsync itself). A frame that drew
+    nothing instead waits for input or for the scene's next change, up to
+    IDLE_WAIT, unless idle is off.
+    """
+
+    def __init__(self, fps=FRAME_RATE, idle=True):
+        self.period = 1.0 / fps if fps else 0.0
+        self.idleWait = idle
+        self.idle = False  # Whether the last wait() was an idle one
+        self.due = default_timer()
+        self.woken = []  # The events an idle wait woke up to
+        self.frames = self.idleFrames = 0
+        self.waited = 0.0  # ms the last wait() took
+        self.millis = 0.0  # ms between the last two wait() returns
+        self.last = default_timer()
+        self.recent = deque(maxlen=10)
+        self.cpuStart = self.cpuTotal = process_time()
+        self.wallTotal = default_timer()
+
+    def begin(self):
+        self.cpuStart = process_time()
+
+    def cpu(self):
+        """CPU time of the process since begin(), in ms"""
+        return (process_time() - self.cpuStart) * 1000.0
+
+    def events(self):
+        events, self.woken = self.woken + event.get(), []
+        return events
+
+    def wait(self, busy, wake=None):
+        """Sleep until the next frame is due. busy: whether the frame drew
+        or has work left; wake: ms until the scene next changes by itself,
+        None if only input changes it."""
+        start = default_timer()
+        self.idle = (self.idleWait and not busy
+                     and (wake is None or wake > 0))
+        if self.idle:
+            # Polled, as event.wait() spins on drivers that cannot block
+            timeout = IDLE_WAIT if wake is None else min(IDLE_WAIT, wake)
+            end = start + timeout / 1000.0
+            while not self.woken:
+                left = end - default_timer()
+                if left <= 0:
+                    break
+                sleep(min(IDLE_POLL, left))
+                self.woken = event.get()
+            self.idleFrames += 1
+            self.due = default_timer()
+        elif self.period:
+            self.due += self.period
+            if self.due > start:
+                sleep(self.due - start)
+            else:
+                self.due = start  # Late, start over rather than rush
+        now = default_timer()
+        self.frames += 1
+        self.waited = (now - start) * 1000.0
+        self.millis = (now - self.last) * 1000.0
+        self.last = now
+        self.recent.append(self.millis)
+
+    def rate(self):
+        """Frames per second over the last few frames"""
+        total = sum(self.recent)
+        return 1000.0 * len(self.recent) / total if total else 0.0
+
+    def stats(self):
+        cpu = (process_time() - self.cpuTotal) * 1000.0
+        wall = (default_timer() - self.wallTotal) * 1000.0
+        return {'frames': self.frames, 'idleFrames': self.idleFrames,
+                'cpuPerFrame': cpu / max(1, self.frames),
+                'cpuShare': cpu / wall if wall else 0.0}
+
+
 class SpaceInvaders(object):
-    def __init__(self):
-        # It seems, in Linux buffersize=512 is not enough, use 4096 to prevent:
-        #   ALSA lib pcm.c:7963:(snd_pcm_recover) underrun occurred
-        mixer.pre_init(44100, -16, 1, 4096)
+    def __init__(self, seed=None, recorder=None, profiler=None,
+                 config=DEFAULT_CONFIG, telemetry=None, capture=None,
+                 fps=FRAME_RATE, vsync=False):
+        mixer.pre_init(*AUDIO_FORMAT + (AUDIO_BUFFER,))
         init()
+        self.audio = NullAudio() if HEADLESS else AudioThread(ASSETS)
+        self.config = config
+        self.screen = None
+        if vsync:
+            try:
+                self.screen = display.set_mode(config.size, SCALED, vsync=1)
+                fps = 0  # display.update() waits for the vsync
+            except error:
+                pass
+        if self.screen is None:
+            self.screen = display.set_mode(config.size)
         self.caption = display.set_caption('Space Invaders')
-
-        self.mainScene = MainScene(on_key_up=self.start_game)
-        self.gameScene = GameScene(on_round=self.show_round,
-                                   on_over=self.show_over)
+        ASSETS.preload(config.size)
+
+        self.ticker = SimClock()
+        self.scenes = SceneManager(self.screen)
+        self.mainScene = self.scenes.add('main', MainScene(
+            on_key_up=self.start_game, clock=self.ticker, events=self.ticker,
+            config=config))
+        self.gameScene = self.scenes.add('game', GameScene(
+            on_round=self.show_round, on_over=self.show_over,
+            clock=self.ticker, events=self.ticker, seed=seed, config=config,
+            audio=self.audio, smooth=True))
+        self.scenes.add('round', NextRoundScene(
+            on_finish=self.start_round, clock=self.ticker, events=self.ticker,
+            config=config)).add(self.gameScene.dashGroup)
+        self.scenes.add('over', GameOverScene(
+            on_finish=self.show_main, clock=self.ticker, events=self.ticker,
+            config=config)).add(self.gameScene.dashGroup)
         self.clock = time.Clock()
-        self.scene = self.mainScene
+        # Captures need a frame every period, drawn or not
+        self.pacer = FramePacer(fps, idle=capture is None)
+        self.scene = self.scenes.switch('main')
+        # Every game gets its own seed so that it can be replayed alone
+        self.random = Random(seed)
+        self.recorder = recorder
+        self.profiler = profiler
+        self.telemetry = telemetry
+        self.capture = capture
+        self.round = 0
+        if profiler:
+            self.gameScene.check_collisions = profiler.timed(
+                'collisions', self.gameScene.check_collisions)
+            self.profileTxt = Txt(FONT, 12, '', RED, 100,
+                                  config.height - 13)
 
     def start_game(self):
+        seed = self.random.getrandbits(32)
+        self.gameScene.random.seed(seed)
+        if self.recorder:
+            self.recorder.start(seed, self.ticker.tick,
+                                 self.gameScene.mysteryVelocity, self.config)
         self.gameScene.new_game()
-        self.scene = self.gameScene
-        self.scene.repaint_rect(SCREEN.get_rect())
+        self.round = 1
+        if self.telemetry:
+            self.telemetry.start_game(seed, self.gameScene)
+        self.scene = self.scenes.switch('game')
 
     def start_round(self):
         self.gameScene.new_round()
-        self.scene = self.gameScene
-        self.scene.repaint_rect(SCREEN.get_rect())
+        self.round += 1
+        self.scene = self.scenes.switch('game')
 
     def show_round(self):
-        self.scene = NextRoundScene(on_finish=self.start_round)
-        self.scene.add(self.gameScene.dashGroup)
+        if self.telemetry:
+            self.telemetry.end_round(self.gameScene, self.round, True)
+        # Built while the banner shows, for start_round() to take
+        position = self.gameScene.enemyPosition + ENEMY_MOVE_DOWN
+        self.scenes.defer(lambda: self.gameScene.prepare_enemies(position))
+        self.scene = self.scenes.switch('round', overlay=True)
 
     def show_over(self):
-        self.scene = GameOverScene(on_finish=self.show_main)
-        self.scene.add(self.gameScene.dashGroup)
+        if self.recorder:
+            self.recorder.stop(self.gameScene.scoreTxt.msg)
+        if self.telemetry:
+            self.telemetry.end_game(self.gameScene, self.round)
+        self.scenes.defer(lambda: self.gameScene.prepare_enemies(
+            ENEMY_DEFAULT_POSITION))
+        self.scene = self.scenes.switch('over', overlay=True)
 
     def show_main(self):
-        self.scene = self.mainScene
-        self.scene.repaint_rect(SCREEN.get_rect())
+        self.scene = self.scenes.switch('main')
+
+    def tick(self, keys):
+        fire = False
+        for evt in self.ticker.get():
+            fire |= (self.scene is self.gameScene and evt.type == KEYDOWN
+                     and evt.key == K_SPACE)
+            self.scene.process_event(evt)
+        if self.recorder:
+            self.recorder.record(keys[K_LEFT], keys[K_RIGHT], fire)
+        if self.profiler:
+            self.profiler.mark('events')
+        self.scene.update(self.ticker.get_ticks(), keys)
+        self.ticker.step()
+        if self.profiler:
+            self.profiler.mark('update')
+
+    def skip(self, ticks):
+        """Let ticks pass without updates, when the scene said they would
+        not change it"""
+        if self.recorder:
+            for _ in range(ticks):
+                self.recorder.record(False, False, False)
+        self.ticker.skip(ticks)
+
+    def profile_frame(self, ticks, dirty, hitch=None):
+        profiler = self.profiler
+        profiler.mark('display')
+        counters = {'ticks': ticks, 'rects': len(dirty),
+                    'switchMs': hitch or 0.0, 'cpuMs': self.pacer.cpu(),
+                    'waitMs': self.pacer.waited,
+                    'idle': int(self.pacer.idle),
+                    'area': sum(rect.w * rect.h for rect in dirty),
+                    'blitted': self.scene.blitted, 'blits': self.scene.blits,
+                    'audioPending': self.audio.stats()['pending']}
+        if self.capture:
+            stats = self.capture.stats()
+            counters['captureDropped'] = stats['dropped']
+            counters['capturePending'] = stats['pending']
+        for layer in self.scene.layers():
+            counters['layer%d' % layer] = len(
+                self.scene.get_sprites_from_layer(layer))
+        for cls_ in POOLED:
+            stats = cls_.pool.stats()
+            counters[cls_.__name__ + 'Active'] = stats['active']
+            counters[cls_.__name__ + 'Free'] = stats['free']
+        profiler.end(**counters)
+        # Refresh the overlay twice a second, not every frame
+        if len(profiler.frames) % 30 == 0:
+            self.profileTxt.msg = profiler.overlay()
+        if not self.scene.has(self.profileTxt):
+            self.scene.add(self.profileTxt)
 
     def main(self):
+        try:
+            self.loop()
+        finally:
+            self.audio.close()
+            if self.profiler:
+                self.profiler.close()
+            if self.telemetry:
+                self.telemetry.close()
+            if self.capture:
+                self.capture.close(self.screen)
+
+    def loop(self):
+        profiler = self.profiler
+        pacer = self.pacer
         while True:
-            for evt in event.get():
-                self.scene.process_event(evt)
-
-            # Update all the sprites
-            current_time = time.get_ticks()
+            start = default_timer()
+            pacer.begin()
+            if profiler:
+                profiler.begin()
+            # Input is handled on the next tick, like HeadlessGame.step
+            for evt in pacer.events():
+                self.ticker.post(evt)
+
+            # Update all the sprites in fixed ticks
             keys = key.get_pressed()
-            if DEBUG:
-                self.scene.fps.msg = "FPS: " + str(int(self.clock.get_fps()))
-            self.scene.update(current_time, keys)
+            if DEBUG and not pacer.idle and pacer.frames % 30 == 0:
+                self.scene.fps.msg = "FPS: " + str(int(pacer.rate()))
+            if profiler:
+                profiler.mark('poll')
+            ticks = self.ticker.advance(pacer.millis, pacer.idle)
+            if pacer.idle and ticks > 1:
+                # Only the last tick of an idle wait can change the scene
+                self.skip(ticks - 1)
+                ticks = 1
+            for _ in range(ticks):
+                self.tick(keys)
 
             # Draw the scene
-            dirty = self.scene.draw(SCREEN)
+            dirty = self.scenes.draw()
+            if profiler:
+                profiler.mark('draw')
             display.update(dirty)
-            self.clock.tick(60)
+            if self.capture:
+                self.capture.frame(self.screen, dirty)
+            hitch = self.scenes.end_frame(start)
+            if profiler:
+                self.profile_frame(ticks, dirty, hitch)
+            self.scenes.idle(start + IDLE_BUDGET)
+            wake = self.scene.next_change(self.ticker.get_ticks())
+            pacer.wait(dirty or self.scenes.tasks,
+                       None if wake is None else self.ticker.until(wake))
+            millis = self.clock.tick()
+            if self.telemetry and self.scene is self.gameScene:
+                self.telemetry.frame(millis)
+
+
+class HeadlessGame(object):
+    """GameScene rules without display, sound or wall clock.
+
+    Each step() is one fixed tick, a SpaceInvaders.main frame at 60 FPS.
+    """
+
+    def __init__(self, seed=None, config=DEFAULT_CONFIG, telemetry=None):
+        font.init()  # Txt sprites still need their rects
+        self.seed = seed
+        self.config = config
+        self.telemetry = telemetry
+        self.clock = SimClock()
+        self.gameScene = GameScene(on_round=self.show_round,
+                                   on_over=self.show_over,
+                                   clock=self.clock, events=self.clock,
+                                   seed=seed, config=config)
+        self.scene = self.gameScene
+        self.drawnScene = None
+        self.round = 0
+        self.over = False
+
+    def reset(self):
+        self.gameScene.new_game()
+        self.scene = self.gameScene
+        self.drawnScene = None
+        self.round = 1
+        self.over = False
+        if self.telemetry:
+            self.telemetry.start_game(self.seed, self.gameScene)
+        return self.state()
+
+    def start_round(self):
+        self.gameScene.new_round()
+        self.scene = self.gameScene
+        self.round += 1
+
+    def show_round(self):
+        if self.telemetry:
+            self.telemetry.end_round(self.gameScene, self.round, True)
+        self.scene = self.next_round_scene()
+
+    def next_round_scene(self):
+        scene = NextRoundScene(on_finish=self.start_round, clock=self.clock,
+                               events=self.clock, config=self.config)
+        scene.add(self.gameScene.dashGroup)
+        return scene
+
+    def show_over(self):
+        if self.telemetry and not self.over:
+            self.telemetry.end_game(self.gameScene, self.round)
+        self.over = True
+
+    def snapshot(self):
+        """Everything step() depends on, as nested tuples of plain values
+        (marshal can store them); restore() plays on from there"""
+        timer = None if self.scene is self.gameScene else self.scene.timer
+        return (self.clock.snapshot(), self.gameScene.snapshot(),
+                self.round, self.over, timer)
+
+    def restore(self, state):
+        clock, scene, self.round, self.over, timer = state
+        self.clock.restore(clock)
+        self.gameScene.restore(scene)
+        if timer is None:
+            self.scene = self.gameScene
+        else:
+            self.scene = self.next_round_scene()
+            self.scene.timer = timer
+        self.drawnScene = None  # Repaint all of the next render
+
+    def render(self, surface):
+        # Off-screen rendering, e.g. for pixel observations
+        if self.scene is not self.drawnScene:
+            self.drawnScene = self.scene
+            self.scene.repaint_rect(surface.get_rect())
+        return self.scene.draw(surface)
+
+    def step(self, actions):
+        """actions: (left, right, fire) booleans for this frame"""
+        if self.over:
+            return self.state()
+        left, right, fire = actions
+        if fire:
+            self.clock.post(FIRE_EVENT)
+        for evt in self.clock.get():
+            self.scene.process_event(evt)
+        keys = {K_LEFT: left, K_RIGHT: right}
+        self.scene.update(self.clock.get_ticks(), keys)
+        self.clock.step()
+        return self.state()
+
+    def state(self):
+        scene = self.gameScene
+        player = scene.player if scene.player.alive() else None
+        mystery = next(iter(scene.mysteries), None)
+        return {
+            'time': self.clock.get_ticks(),
+            'round': self.round,
+            'over': self.over,
+            'score': scene.scoreTxt.msg,
+            'lives': sum(1 for life in (scene.life1, scene.life2, scene.life3)
+                         if life.alive()),
+            'ship': player.rect.x if player else None,
+            'enemies': len(scene.enemies),
+            'bullets': [b.rect.topleft for b in scene.bullets],
+            'enemyBullets': [b.rect.topleft for b in scene.enemyBullets],
+            'mystery': mystery.rect.x if mystery else None,
+        }
 
 
 if __name__ == '__main__':
-    game = SpaceInvaders()
+    parser = ArgumentParser(description='Space Invaders')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--record', metavar='FILE',
+                        help='append a recording of every game to FILE')
+    parser.add_argument('--profile', metavar='FILE', nargs='?', const='',
+                        help='show frame timings, and save them to FILE '
+                             '(.csv or .json) on exit')
+    parser.add_argument('--telemetry', metavar='FILE',
+                        help='store game results and round statistics in '
+                             'the SQLite database FILE')
+    parser.add_argument('--capture', metavar='TARGET',
+                        help='record the frames as PNG files (a name with '
+                             '%%d), raw RGB frames, or piped to |COMMAND')
+    parser.add_argument('--capture-every', type=int, default=1, metavar='N',
+                        help='capture one frame in N')
+    parser.add_argument('--config', metavar='FILE',
+                        help='read the GameConfig settings from a JSON file')
+    parser.add_argument('--scale', type=float,
+                        help='play GameConfig.scaled(SCALE) times the enemies')
+    parser.add_argument('--fps', type=int, default=FRAME_RATE,
+                        help='frames per second while playing, 0 for no '
+                             'limit (default %(default)s)')
+    parser.add_argument('--vsync', action='store_true',
+                        help='pace frames by the display refresh instead')
+    parser.add_argument('--bundle', action='store_true',
+                        help='precompile the images and sounds into '
+                             'assets.bundle and exit')
+    args = parser.parse_args()
+    if args.bundle:
+        mixer.init(*AUDIO_FORMAT)  # As SpaceInvaders plays them
+        ASSETS.save_bundle()
+        sys.exit()
+    recorder = profiler = telemetry = capture = None
+    if args.record:
+        from recording import Recorder
+        recorder = Recorder(args.record)
+    if args.profile is not None:
+        from profiler import Profiler
+        profiler = Profiler(args.profile)
+    if args.telemetry:
+        from telemetry import Telemetry
+        telemetry = Telemetry(args.telemetry)
+    config = DEFAULT_CONFIG
+    if args.config:
+        config = GameConfig.load(args.config)
+    elif args.scale:
+        config = GameConfig.scaled(args.scale)
+    if args.capture:
+        from capture import FrameCapture
+        capture = FrameCapture(args.capture, config.size, args.capture_every)
+    game = SpaceInvaders(args.seed, recorder, profiler, config, telemetry,
+                         capture, args.fps, args.vsync)
     game.main()
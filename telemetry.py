@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# Results of every game and statistics of every round, kept in SQLite:
+#   python spaceinvaders.py --telemetry games.db
+#   python telemetry.py games.db top        leaderboard
+#   python telemetry.py games.db stats      aggregates per session
+
+import os
+import sqlite3
+import sys
+import time
+from argparse import ArgumentParser
+from queue import Empty, SimpleQueue
+from threading import Thread
+
+from profiler import percentile
+
+BATCH_SIZE = 512  # Rows written in one transaction at most
+FLUSH_INTERVAL = 1.0  # Seconds a row may wait for others to share a commit
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    session TEXT, game INTEGER, seed INTEGER, ended REAL,
+    score INTEGER, rounds INTEGER, millis INTEGER,
+    PRIMARY KEY (session, game));
+CREATE INDEX IF NOT EXISTS games_score ON games (score DESC);
+CREATE TABLE IF NOT EXISTS rounds (
+    session TEXT, game INTEGER, round INTEGER, cleared INTEGER,
+    millis INTEGER, kills INTEGER, shots INTEGER, hits INTEGER,
+    frames INTEGER, frameP50 REAL, frameP99 REAL, frameMax REAL,
+    PRIMARY KEY (session, game, round));
+'''
+INSERTS = {'games': 'INSERT OR REPLACE INTO games '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+           'rounds': 'INSERT OR REPLACE INTO rounds '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'}
+
+
+class TelemetryWriter(Thread):
+    """Writes rows queued by put() to an SQLite file, many per transaction,
+    so the game loop never waits on the disk"""
+
+    def __init__(self, path, batch=BATCH_SIZE, interval=FLUSH_INTERVAL):
+        super(TelemetryWriter, self).__init__(name='telemetry', daemon=True)
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        self.commands = SimpleQueue()
+        self.written = self.commits = 0
+        self.start()
+
+    def put(self, table, row):
+        self.commands.put((table, row))
+
+    def run(self):
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript(SCHEMA)
+        closing = False
+        while not closing:
+            rows = [self.commands.get()]
+            deadline = time.monotonic() + self.interval
+            while len(rows) < self.batch:
+                try:
+                    rows.append(self.commands.get(
+                        timeout=max(0.0, deadline - time.monotonic())))
+                except Empty:
+                    break
+            if None in rows:
+                closing = True
+                rows = [row for row in rows if row is not None]
+            with db:
+                for table in INSERTS:
+                    db.executemany(INSERTS[table], [
+                        row for table_, row in rows if table_ == table])
+            self.written += len(rows)
+            self.commits += 1
+        db.close()
+
+    def close(self):
+        """Write what is still queued and wait for it"""
+        self.commands.put(None)
+        self.join()
+
+    def stats(self):
+        return {'written': self.written, 'commits': self.commits,
+                'pending': self.commands.qsize()}
+
+
+class Telemetry(object):
+    """Collects the results of the games a SpaceInvaders or HeadlessGame
+    plays, and frame times per round, for a TelemetryWriter"""
+
+    def __init__(self, path, session=None, **kwargs):
+        self.session = session or '%x-%x' % (int(time.time()), os.getpid())
+        self.writer = TelemetryWriter(path, **kwargs)
+        self.games = 0
+        self.game = None  # (number, seed, start) of the game being played
+        self.frames = []
+
+    def start_game(self, seed, scene):
+        self.games += 1
+        self.game = (self.games, seed, scene.clock.get_ticks())
+        self.frames = []
+
+    def frame(self, millis):
+        self.frames.append(millis)
+
+    def end_round(self, scene, round_, cleared):
+        if self.game is None:
+            return
+        frames = self.frames
+        self.writer.put('rounds', (
+            self.session, self.game[0], round_, cleared,
+            scene.clock.get_ticks() - scene.roundStart, scene.kills,
+            scene.shots, scene.hits, len(frames), percentile(frames, 0.5),
+            percentile(frames, 0.99), max(frames) if frames else 0.0))
+        self.frames = []
+
+    def end_game(self, scene, rounds):
+        """Write the game's last round, not cleared, and its result"""
+        if self.game is None:
+            return
+        self.end_round(scene, rounds, False)
+        number, seed, start = self.game
+        self.writer.put('games', (self.session, number, seed, time.time(),
+                                  scene.scoreTxt.msg, rounds,
+                                  scene.clock.get_ticks() - start))
+        self.game = None
+
+    def close(self):
+        self.writer.close()
+
+
+QUERIES = {
+    'top': ('SELECT score, rounds, millis / 1000.0, session, game, seed '
+            'FROM games ORDER BY score DESC LIMIT ?',
+            ('score', 'rounds', 'seconds', 'session', 'game', 'seed')),
+    'stats': ('SELECT g.session, count(*), avg(g.score), max(g.score), '
+              'sum(r.kills), sum(r.shots), '
+              'sum(r.hits) * 1.0 / max(sum(r.shots), 1), '
+              'sum(r.millis) / 1000.0 / sum(r.rounds), '
+              'avg(r.frameP50), max(r.frameP99) '
+              'FROM games g JOIN (SELECT session, game, sum(kills) kills, '
+              'sum(shots) shots, sum(hits) hits, sum(millis) millis, '
+              'count(*) rounds, avg(frameP50) frameP50, '
+              'max(frameP99) frameP99 FROM rounds GROUP BY session, game) r '
+              'USING (session, game) GROUP BY g.session '
+              'ORDER BY max(g.ended) DESC LIMIT ?',
+              ('session', 'games', 'avg score', 'best', 'kills', 'shots',
+               'accuracy', 's/round', 'frame p50', 'frame p99')),
+}
+
+
+def query(path, name, limit=10):
+    """Column names and rows of one of QUERIES"""
+    sql, columns = QUERIES[name]
+    db = sqlite3.connect(path)
+    try:
+        return columns, db.execute(sql, (limit,)).fetchall()
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Space Invaders telemetry')
+    parser.add_argument('path')
+    parser.add_argument('query', choices=sorted(QUERIES), nargs='?',
+                        default='top')
+    parser.add_argument('-n', type=int, default=10, help='rows to show')
+    args = parser.parse_args()
+    if not os.path.exists(args.path):
+        sys.exit('%s: no such file' % args.path)
+    columns, rows = query(args.path, args.query, args.n)
+    print(' '.join('%12s' % name for name in columns))
+    for row in rows:
+        print(' '.join('%12.2f' % value if isinstance(value, float)
+                       else '%12s' % value for value in row))
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+# Space Invaders
+# HeadlessGames spread over worker processes, observations in shared memory
+
+import multiprocessing as mp
+import sys
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+WIDTH, HEIGHT = 800, 600
+INFO_FIELDS = ('score', 'lives', 'round', 'over')
+
+
+def frame_shape(obs, downsample):
+    if obs == 'rgb':
+        return HEIGHT, WIDTH, 3
+    if obs in ('gray', 'sketch'):
+        return HEIGHT // downsample, WIDTH // downsample
+    if obs == 'state':
+        from observation import ObservationEncoder
+        from spaceinvaders import DEFAULT_CONFIG
+        return ObservationEncoder(DEFAULT_CONFIG).size,
+    return 0,
+
+
+def frame_dtype(obs):
+    return np.int32 if obs == 'state' else np.uint8
+
+
+class SharedArrays(object):
+    """Observation, info and action arrays of all games in shared memory"""
+
+    def __init__(self, n_games, shape, names=None, dtype=np.uint8):
+        specs = [((n_games,) + shape, dtype),
+                 ((n_games, len(INFO_FIELDS)), np.int64),
+                 ((n_games, 3), np.bool_)]
+        self.memory = []
+        arrays = []
+        for i, (shape_, dtype) in enumerate(specs):
+            size = max(1, int(np.prod(shape_)) * np.dtype(dtype).itemsize)
+            if names is None:
+                memory = SharedMemory(create=True, size=size)
+            else:
+                memory = SharedMemory(name=names[i])
+            self.memory.append(memory)
+            arrays.append(np.ndarray(shape_, dtype, buffer=memory.buf))
+        self.observations, self.info, self.actions = arrays
+        self.names = [memory.name for memory in self.memory]
+
+    def close(self, unlink=False):
+        del self.observations, self.info, self.actions
+        for memory in self.memory:
+            memory.close()
+            if unlink:
+                memory.unlink()
+
+
+def _worker(pipe, names, n_games, first, last, seed, obs, downsample):
+    from pygame import Surface, surfarray, transform
+    from spaceinvaders import HeadlessGame
+
+    shape = frame_shape(obs, downsample)
+    shared = SharedArrays(n_games, shape, names, frame_dtype(obs))
+    games = [HeadlessGame(seed + i) for i in range(first, last)]
+    pixels = obs in ('rgb', 'gray')
+    screens = [Surface((WIDTH, HEIGHT)) for _ in games] if pixels else []
+    small = Surface(shape[::-1]) if obs == 'gray' else None
+
+    def publish(i, state):
+        shared.info[i] = [state[field] for field in INFO_FIELDS]
+        if not obs:
+            return
+        if obs == 'state':
+            games[i - first].gameScene.observe(shared.observations[i])
+            return
+        if obs == 'sketch':
+            games[i - first].gameScene.observe_frame(
+                downsample, shared.observations[i])
+            return
+        screen = screens[i - first]
+        games[i - first].render(screen)
+        if obs == 'rgb':
+            shared.observations[i] = surfarray.pixels3d(screen).swapaxes(0, 1)
+        else:
+            transform.scale(screen, small.get_size(), small)
+            rgb = surfarray.pixels3d(small).astype(np.uint16)
+            gray = (rgb[..., 0] * 77 + rgb[..., 1] * 150
+                    + rgb[..., 2] * 29) >> 8
+            shared.observations[i] = gray.T
+
+    try:
+        while True:
+            command = pipe.recv()
+            if command == 'close':
+                break
+            for i, game in enumerate(games, first):
+                # Games that ended are restarted on the following step
+                if command == 'reset' or game.over:
+                    state = game.reset()
+                else:
+                    state = game.step(shared.actions[i])
+                publish(i, state)
+            pipe.send(command)
+    finally:
+        shared.close()
+        pipe.close()
+
+
+class VecEnv(object):
+    """N HeadlessGames hosted by worker processes.
+
+    obs is 'gray' (frames downsampled by an integer factor), 'rgb' (full
+    800x600 frames), 'sketch' (downsampled frames drawn from the state,
+    see GameScene.observe_frame), 'state' (GameScene.observe vectors) or
+    None (info only). observations and info are views on
+    shared memory that workers write in place, so they are only valid until
+    the next step.
+    """
+
+    def __init__(self, n_games, n_workers=None, seed=0, obs='gray',
+                 downsample=4):
+        n_workers = min(n_games, n_workers or mp.cpu_count())
+        self.n_games = n_games
+        self._shared = SharedArrays(n_games, frame_shape(obs, downsample),
+                                    dtype=frame_dtype(obs))
+        self.observations = self._shared.observations
+        self.info = self._shared.info
+        self._pipes = []
+        self._processes = []
+        self._waiting = False
+        context = mp.get_context('spawn')
+        bounds = np.linspace(0, n_games, n_workers + 1).astype(int)
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            pipe, child = context.Pipe()
+            process = context.Process(
+                target=_worker, daemon=True,
+                args=(child, self._shared.names, n_games, first, last,
+                      seed, obs, downsample))
+            process.start()
+            child.close()
+            self._pipes.append(pipe)
+            self._processes.append(process)
+
+    def _send(self, command):
+        for pipe in self._pipes:
+            pipe.send(command)
+
+    def _wait(self):
+        for pipe in self._pipes:
+            pipe.recv()
+
+    def reset(self):
+        self._send('reset')
+        self._wait()
+        return self.observations, self.info
+
+    def step_async(self, actions):
+        self._shared.actions[:] = actions
+        self._send('step')
+        self._waiting = True
+
+    def step_wait(self):
+        self._wait()
+        self._waiting = False
+        return self.observations, self.info
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self._waiting:
+            self.step_wait()
+        self._send('close')
+        for process in self._processes:
+            process.join()
+        self.observations = self.info = None
+        self._shared.close(unlink=True)
+
+
+def scaling(n_games, ticks=300, obs='gray'):
+    """Game ticks per second for increasing worker counts"""
+    workers = 1
+    while workers <= min(n_games, mp.cpu_count()):
+        env = VecEnv(n_games, workers, obs=obs)
+        env.reset()
+        actions = np.zeros((n_games, 3), bool)
+        start = time.time()
+        for _ in range(ticks):
+            env.step(actions)
+        yield workers, n_games * ticks / (time.time() - start)
+        env.close()
+        workers *= 2
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    obs = sys.argv[2] if len(sys.argv) > 2 else 'gray'
+    for workers, rate in scaling(n, obs=obs):
+        print('%3d workers: %8.0f ticks/s' % (workers, rate))